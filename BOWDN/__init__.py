@@ -1 +1,2 @@
-from .command_catalogue import CommandCatalogue
\ No newline at end of file
+from .command_catalogue import CommandCatalogue
+from .token_type import TokenType
\ No newline at end of file
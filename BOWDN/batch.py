@@ -0,0 +1,149 @@
+"""
+Runs many messages through a CommandCatalogue on a thread pool or a process pool.
+"""
+import collections
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+
+class ParseResult:
+    """
+    The ParseResult class holds the outcome of parsing one message in a batch.
+    If running the message raised an exception, it is stored in self.exception instead of being raised.
+    """
+    def __init__(self,
+        index: int,
+        message: str,
+        value     = None,
+        exception = None
+    ):
+        self.index     = index
+        self.message   = message
+        self.value     = value
+        self.exception = exception
+
+    @property
+    def ok(self):
+        return self.exception is None
+
+    def __repr__(self):
+        if self.ok:
+            return f"ParseResult({self.index}, {self.message!r}, value={self.value!r})"
+        return f"ParseResult({self.index}, {self.message!r}, exception={self.exception!r})"
+
+
+def parse_to_result(catalogue, index: int, message: str, default, args, kwargs):
+    """
+    Parses one message with a catalogue and wraps its return value or exception in a ParseResult.
+    """
+    try:
+        return ParseResult(index, message, value = catalogue.parse(message, default, *args, **kwargs))
+    except Exception as e:
+        return ParseResult(index, message, exception = e)
+
+
+# The catalogue of a process pool worker, built once by init_worker when the worker starts
+worker_catalogue = None
+
+def init_worker(commands_dict: dict, settings: dict, snapshot_path: str = None):
+    """
+    Builds the worker's catalogue from commands_dict, or loads it from snapshot_path if it is given.
+    """
+    global worker_catalogue
+    from .command_catalogue import CommandCatalogue
+    if snapshot_path is not None:
+        worker_catalogue = CommandCatalogue.load_snapshot(snapshot_path)
+    else:
+        worker_catalogue = CommandCatalogue(commands_dict, **settings)
+
+def parse_in_worker(index: int, message: str, default, args, kwargs):
+    return parse_to_result(worker_catalogue, index, message, default, args, kwargs)
+
+
+def parse_many(catalogue, messages, default = None, args = (), kwargs = None,
+    executor = "thread",
+    max_workers: int = None,
+    ordered: bool = True,
+    max_pending: int = None
+):
+    """
+    Parses every message of an iterable and yields a ParseResult for each one.
+    See CommandCatalogue.parse_many for the meaning of the arguments.
+    """
+    kwargs = kwargs or {}
+    if isinstance(executor, ProcessPoolExecutor):
+        raise ValueError(
+            "A ProcessPoolExecutor cannot be used, since the catalogue cannot be sent to its workers. "
+            "Use executor=\"process\", which builds the catalogue in each worker instead."
+        )
+    if isinstance(executor, Executor):
+        yield from run_batch(executor, catalogue, messages, default, args, kwargs, ordered, max_pending or 64, False)
+        return
+
+    max_workers = max_workers or os.cpu_count() or 1
+    if executor == "thread":
+        pool = ThreadPoolExecutor(max_workers)
+        in_worker = False
+    elif executor == "process":
+        if catalogue.commands_dict is not None:
+            initargs = (catalogue.commands_dict, catalogue.settings)
+        elif catalogue.snapshot_path is not None:
+            initargs = (None, catalogue.settings, catalogue.snapshot_path)
+        else:
+            raise ValueError(
+                "The process executor needs the commands dict of the catalogue to build it in each worker, "
+                "but it is not known. Pass commands_dict to load_snapshot, or use the thread executor."
+            )
+        pool = ProcessPoolExecutor(max_workers, initializer = init_worker, initargs = initargs)
+        in_worker = True
+    else:
+        raise ValueError(f"Unknown executor '{executor}'. Expected 'thread', 'process' or a concurrent.futures.Executor.")
+
+    with pool:
+        yield from run_batch(pool, catalogue, messages, default, args, kwargs, ordered, max_pending or 4 * max_workers, in_worker)
+
+
+def run_batch(pool, catalogue, messages, default, args, kwargs, ordered, max_pending, in_worker):
+    """
+    Submits the messages to the pool, keeping at most max_pending of them in flight,
+    so that messages from a generator (ie. a file or stdin) are only read as they are needed.
+    """
+    # The index and message of every future in flight, for the ParseResult of a future that fails
+    messages_of = {}
+
+    def submit(index, message):
+        if in_worker:
+            future = pool.submit(parse_in_worker, index, message, default, args, kwargs)
+        else:
+            future = pool.submit(parse_to_result, catalogue, index, message, default, args, kwargs)
+        messages_of[future] = (index, message)
+        return future
+
+    def get_result(future):
+        index, message = messages_of.pop(future)
+        try:
+            return future.result()
+        except Exception as e:
+            # ie. the arguments or the result could not be pickled, or a worker died
+            return ParseResult(index, message, exception = e)
+
+    if ordered:
+        pending = collections.deque()
+        for index, message in enumerate(messages):
+            pending.append(submit(index, message))
+            if len(pending) >= max_pending:
+                yield get_result(pending.popleft())
+        while pending:
+            yield get_result(pending.popleft())
+    else:
+        pending = set()
+        for index, message in enumerate(messages):
+            pending.add(submit(index, message))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    yield get_result(future)
+        while pending:
+            done, pending = wait(pending, return_when = FIRST_COMPLETED)
+            for future in done:
+                yield get_result(future)
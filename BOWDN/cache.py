@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize", "evictions", "expirations"])
+
+
+class LRUCache:
+    """
+    A thread-safe, bounded, least recently used cache.
+    Once maxsize entries are stored, adding another evicts the least recently used one.
+    If ttl is given, entries also expire ttl seconds after they were stored.
+    """
+    def __init__(self, maxsize: int = 128, ttl: float = None):
+        self.maxsize     = maxsize
+        self.ttl         = ttl
+        self.hits        = 0
+        self.misses      = 0
+        self.evictions   = 0
+        self.expirations = 0
+        self.entries     = OrderedDict()
+        self.lock        = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        # The entries and the lock are not kept when a cache is pickled, ie. in a snapshot
+        return {"maxsize": self.maxsize, "ttl": self.ttl}
+
+    def __setstate__(self, state):
+        self.__init__(state["maxsize"], state["ttl"])
+
+    def get(self, key, default = None):
+        """
+        Returns the value stored for key and marks it as recently used,
+        or default if the key is not in the cache or has expired.
+        """
+        with self.lock:
+            try:
+                value, expires = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Stores value for key, evicting the least recently used entry if the cache is full.
+        """
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Removes every entry from the cache. The counters are kept.
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def info(self):
+        """
+        Returns a CacheInfo with the counters and the size of the cache.
+        """
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self.entries), self.evictions, self.expirations)
@@ -1,35 +1,384 @@
-from .exceptions import raise_exception, CommandFunctionNotAssignedException
+import asyncio
+import copy
+import functools
+import inspect
+import threading
+from types import MappingProxyType
+from .exceptions import CommandFunctionNotAssignedException, CommandArgumentsException, DuplicateAliasException
 from .command_context import FlagValue
+from .flag import Flag
+from .suggestions import SuggestionIndex
+
+
+# Shared by every Command and lookup table that has nothing in it, so they do not each allocate an empty dict
+EMPTY_MAPPING = MappingProxyType({})
+
+# The types of default values that identical flag definitions can be recognized by, see FlagPool
+INTERNABLE_TYPES = (type(None), bool, int, float, str)
+
+# Held while a lazy Command builds its sub commands, so that two threads never build the same ones
+LAZY_LOCK = threading.RLock()
+
+
+class FunctionNotAssigned:
+    """
+    The function of a Command that was not given one.
+    Raises a CommandFunctionNotAssignedException when it is called.
+    """
+    __slots__ = ("command_name",)
+
+    def __init__(self, command_name: str):
+        self.command_name = command_name
+
+    def __call__(self, *args, context = None, **kwargs):
+        raise CommandFunctionNotAssignedException(f"Command {self.command_name} was ran but does not yet have a function implemented.")
+
+
+class FunctionSignature:
+    """
+    What a command function accepts, worked out once with inspect.signature
+    so that each call can be checked without inspecting the function again.
+    -   max_positional is the most positional arguments it takes, or None if it has *args.
+    -   required_positional are the names of the positional parameters without a default, in order.
+    -   required_keywords are the names of the keyword-only parameters without a default.
+    -   keywords are the names it accepts as keyword arguments, or None if it has **kwargs.
+    """
+    __slots__ = ("max_positional", "required_positional", "required_keywords", "keywords")
+
+    def __init__(self, function):
+        """
+        Raises a ValueError or TypeError if the signature of function cannot be inspected.
+        """
+        max_positional      = 0
+        required_positional = []
+        required_keywords   = []
+        keywords            = []
+        for parameter in inspect.signature(function).parameters.values():
+            kind = parameter.kind
+            required = parameter.default is parameter.empty
+            if kind is parameter.VAR_POSITIONAL:
+                max_positional = None
+            elif kind is parameter.VAR_KEYWORD:
+                keywords = None
+            elif kind is parameter.KEYWORD_ONLY:
+                if required:
+                    required_keywords.append(parameter.name)
+                if keywords is not None:
+                    keywords.append(parameter.name)
+            else:
+                if max_positional is not None:
+                    max_positional += 1
+                if required:
+                    required_positional.append(parameter.name)
+                if kind is parameter.POSITIONAL_OR_KEYWORD and keywords is not None:
+                    keywords.append(parameter.name)
+        self.max_positional      = max_positional
+        self.required_positional = tuple(required_positional)
+        self.required_keywords   = tuple(required_keywords)
+        self.keywords            = tuple(keywords) if keywords is not None else None
+
+    def check(self, positional_count: int, keywords: dict):
+        """
+        Returns why a call with positional_count positional arguments and the given
+        keyword arguments would fail, or None if it would bind.
+        """
+        if self.max_positional is not None and positional_count > self.max_positional:
+            return f"takes at most {self.max_positional} arguments but was given {positional_count}"
+        for name in self.required_positional[positional_count:]:
+            if name not in keywords:
+                return f"is missing the argument '{name}'"
+        for name in self.required_keywords:
+            if name not in keywords:
+                return f"is missing the keyword argument '{name}'"
+        if self.keywords is not None:
+            for name in keywords:
+                if name not in self.keywords:
+                    return f"does not accept the keyword argument '{name}'"
+        return None
+
+
+@functools.lru_cache(maxsize = 1024)
+def get_function_signature(function):
+    """
+    Returns the FunctionSignature of a command function, or None if it cannot be inspected
+    (ie. some built-in functions), in which case its calls are not checked.
+    Many commands usually share a function, so the signatures are cached.
+    """
+    try:
+        return FunctionSignature(function)
+    except (ValueError, TypeError):
+        return None
+
+
+def add_to_index(index: dict, key, value, kind: str):
+    """
+    Adds key -> value to a lookup index.
+    Raises a DuplicateAliasException if the key already points to a different value.
+    """
+    existing = index.get(key)
+    if existing is not None and existing is not value:
+        raise DuplicateAliasException(f"The {kind} name or alias '{key}' is used by both '{existing}' and '{value}'.")
+    index[key] = value
+
+
+def build_command_index(commands: dict):
+    """
+    Builds a dict that maps every name and alias of the given commands to its Command.
+    Raises a DuplicateAliasException if two commands share a name or alias.
+    """
+    if not commands:
+        return EMPTY_MAPPING
+    index = {}
+    for command_name, command in commands.items():
+        add_to_index(index, command_name, command, "command")
+    for command in commands.values():
+        for alias in command.aliases:
+            add_to_index(index, alias, command, "command")
+    return index
+
+
+def build_flag_indexes(flags: list):
+    """
+    Builds two dicts that map every long and short name or alias of the given flags to its Flag.
+    A long flag token (--name) may also match a short name, so a key that is a long name
+    of one flag and a short name of another is reported as a conflict.
+    """
+    if not flags:
+        return EMPTY_MAPPING, EMPTY_MAPPING
+    long_index  = {}
+    short_index = {}
+    for flag in flags:
+        add_to_index(long_index, flag.long_name, flag, "flag")
+        for alias in flag.long_aliases or ():
+            add_to_index(long_index, alias, flag, "flag")
+        if flag.short_name is not None:
+            add_to_index(short_index, flag.short_name, flag, "flag")
+        for alias in flag.short_aliases or ():
+            add_to_index(short_index, alias, flag, "flag")
+    for key, flag in long_index.items():
+        if key in short_index and short_index[key] is not flag:
+            raise DuplicateAliasException(f"The flag name or alias '{key}' is used by both '{flag}' and '{short_index[key]}'.")
+    return long_index, short_index
+
+
+def build_flag_tables(flags: tuple):
+    """
+    Builds the long and short flag lookup tables of build_flag_indexes,
+    and the read-only template of every flag's default_value_absent that parse copies.
+    """
+    long_index, short_index = build_flag_indexes(flags)
+    flag_defaults = MappingProxyType({flag.long_name: flag.default_value_absent for flag in flags}) if flags else EMPTY_MAPPING
+    return long_index, short_index, flag_defaults
+
+
+class FlagPool:
+    """
+    Interns Flags and flag lookup tables, so that commands with identical flag definitions
+    (ie. a help flag on every command) share one immutable copy of them instead of each building their own.
+    Flags whose default values are not None, bools, numbers or strings are never shared,
+    since they cannot be safely compared.
+    Everything interned is kept for as long as the pool is, even after its commands are removed.
+    """
+    def __init__(self):
+        self.flags  = {}
+        self.tables = {}
+
+    def get_flag(self,
+        long_name: str,
+        long_aliases: tuple   = (),
+        short_name: str       = None,
+        short_aliases: tuple  = (),
+        accepts_input         = False,
+        default_value_present = None,
+        default_value_absent  = None
+    ):
+        """
+        Returns the Flag with this definition, creating it the first time it is asked for.
+        Takes the same arguments as Flag.
+        """
+        definition = (long_name, tuple(long_aliases or ()), short_name, tuple(short_aliases or ()), accepts_input, default_value_present, default_value_absent)
+        if not all(type(value) in INTERNABLE_TYPES for value in definition[4:]):
+            return Flag(*definition)
+        # The types are part of the key, since True == 1 == 1.0
+        key = definition + (type(accepts_input), type(default_value_present), type(default_value_absent))
+        flag = self.flags.get(key)
+        if flag is None:
+            flag = self.flags.setdefault(key, Flag(*definition))
+        return flag
+
+    def get_tables(self, flags: tuple):
+        """
+        Returns the flags as a shared tuple with their shared lookup tables, see build_flag_tables.
+        Flags are compared by identity, so flags from get_flag share the most.
+        """
+        tables = self.tables.get(flags)
+        if tables is None:
+            tables = self.tables.setdefault(flags, (flags,) + build_flag_tables(flags))
+        return tables
+
 
 class Command:
     """
     The Command class defines all the components of a command.
     """ 
+    __slots__ = (
+        "name", 
+        "aliases", 
+        "description", 
+        "function", 
+        "flags", 
+        "sub_commands", 
+        "meta_data", 
+        "sub_command_loader", 
+        "sub_command_index", 
+        "suggestion_index", 
+        "long_flag_index", 
+        "short_flag_index", 
+        "flag_defaults", 
+        "signature", 
+        "result_cache"
+    )
+
     def __init__(self, 
         name: str, 
-        aliases: list = [], 
+        aliases: tuple = (), 
         description: str = None, 
         function = None, 
-        flags: dict = {}, 
-        sub_commands: dict = {}, 
-        meta_data: dict = {}
+        flags: tuple = (), 
+        sub_commands: dict = None, 
+        meta_data: dict = None,
+        sub_command_loader = None,
+        result_cache = None,
+        flag_pool = None
     ):
+        """
+        sub_command_loader is an optional function that returns the dict of sub commands.
+        If it is given, the sub commands are only built the first time they are needed.
+        result_cache is an optional LRUCache that parse keeps the results of the command in,
+        for commands that always return the same result for the same arguments and flags.
+        flag_pool is an optional FlagPool to share the flags and their lookup tables with other commands.
+        """
         self.name         = name
-        self.aliases      = aliases
+        self.aliases      = tuple(aliases)
         self.description  = description
-        self.function     = function if function is not None else lambda *args, context = None, **kwargs: raise_exception(CommandFunctionNotAssignedException(f"Command {self.name} was ran but does not yet have a function implemented."))
-        self.flags        = flags
-        self.sub_commands = sub_commands
-        self.meta_data    = meta_data
+        self.function     = function if function is not None else FunctionNotAssigned(name)
+        self.flags        = tuple(flags)
+        self.sub_commands = sub_commands if sub_commands else EMPTY_MAPPING
+        self.meta_data    = meta_data if meta_data else EMPTY_MAPPING
+        self.sub_command_loader = sub_command_loader
+        self.result_cache = result_cache
+        self.index_sub_commands()
+        self.index_flags(flag_pool)
+        self.inspect_function()
 
-    def get_sub_command(self, token):
-        if token in self.sub_commands.keys():
-            return self.sub_commands[token]
+    def __repr__(self):
+        return self.name
+
+    def index_sub_commands(self):
+        """
+        Builds the lookup table of sub command names and aliases.
+        Must be called again whenever self.sub_commands changes.
+        """
+        self.sub_command_index = build_command_index(self.sub_commands)
+        self.suggestion_index  = None
+
+    def load_sub_commands(self):
+        """
+        Builds the sub commands of a lazy Command if they have not been built yet.
+        Safe to call from many threads at once: the sub commands are only built once,
+        and self.sub_command_loader is only cleared after they are fully indexed.
+        """
+        if self.sub_command_loader is None:
+            return
+        with LAZY_LOCK:
+            loader = self.sub_command_loader
+            if loader is None:
+                return
+            sub_commands = loader()
+            self.sub_commands = sub_commands if sub_commands else EMPTY_MAPPING
+            self.index_sub_commands()
+            self.sub_command_loader = None
+
+    def with_sub_commands(self, sub_commands: dict):
+        """
+        Returns a copy of this Command with different sub commands.
+        This Command is left unchanged, so parses that are already using it are not affected.
+        Raises a DuplicateAliasException if two of the sub commands share a name or alias.
+        """
+        command = copy.copy(self)
+        command.sub_commands = sub_commands if sub_commands else EMPTY_MAPPING
+        command.sub_command_loader = None
+        command.index_sub_commands()
+        return command
+
+    def load_all_sub_commands(self):
+        """
+        Builds every sub command below this Command, ie. before it is saved in a snapshot.
+        """
+        self.load_sub_commands()
+        for sub_command in self.sub_commands.values():
+            sub_command.load_all_sub_commands()
+
+    def index_flags(self, flag_pool = None):
+        """
+        Builds the lookup tables of long and short flag names and aliases,
+        and the read-only template of every flag's default_value_absent that parse copies.
+        If flag_pool is given, the tables are shared with every command that has the same flags.
+        Must be called again whenever self.flags changes.
+        """
+        if flag_pool is not None:
+            self.flags, self.long_flag_index, self.short_flag_index, self.flag_defaults = flag_pool.get_tables(self.flags)
         else:
-            for sub_command in self.sub_commands.values():
-                if token in sub_command.aliases:
-                    return sub_command
-        return None
+            self.long_flag_index, self.short_flag_index, self.flag_defaults = build_flag_tables(self.flags)
+
+    def inspect_function(self):
+        """
+        Works out what self.function accepts, so that run can reject bad calls before calling it.
+        Must be called again whenever self.function changes.
+        """
+        try:
+            self.signature = get_function_signature(self.function)
+        except TypeError:
+            # Unhashable callables cannot be cached
+            self.signature = get_function_signature.__wrapped__(self.function)
+
+    def check_arguments(self, positional_count: int, keywords: dict):
+        """
+        Raises a CommandArgumentsException if self.function cannot be called
+        with positional_count positional arguments and the given keyword arguments.
+        """
+        signature = self.signature
+        if signature is not None:
+            error = signature.check(positional_count, keywords)
+            if error is not None:
+                raise CommandArgumentsException(f"Command {self.name} {error}.", command_name = self.name)
+
+    def get_sub_command_completions(self, prefix: str, limit: int = 10):
+        """
+        Returns up to limit sub command names and aliases that start with prefix.
+        """
+        return self.get_suggestion_index().get_completions(prefix, limit)
+
+    def get_sub_command_suggestions(self, token: str, max_distance: int = 2, limit: int = 5):
+        """
+        Returns up to limit sub command names and aliases within max_distance edits of token, closest first.
+        """
+        return self.get_suggestion_index().get_suggestions(token, max_distance, limit)
+
+    def get_suggestion_index(self):
+        """
+        Returns the SuggestionIndex of the sub commands, building it the first time it is needed.
+        """
+        self.load_sub_commands()
+        suggestion_index = self.suggestion_index
+        if suggestion_index is None:
+            suggestion_index = self.suggestion_index = SuggestionIndex(self.sub_command_index.keys())
+        return suggestion_index
+
+    def get_sub_command(self, token):
+        if self.sub_command_loader is not None:
+            self.load_sub_commands()
+        return self.sub_command_index.get(token)
     
     def get_flag(self, token):
         long_flag = False
@@ -46,28 +395,59 @@ class Command:
         flag_name = input_flag
         flag_value = None
         if "=" in input_flag:
-            flag_end_index = token.find("=")
-            if len(token) - 1 > flag_end_index:
-                flag_name = input_flag[:flag_end_index - 1]
-                flag_value = input_flag[flag_end_index:]
-        
-        for flag in self.flags:
-            if (long_flag and (flag_name == flag.long_name or flag_name in flag.long_aliases)) or (flag_name == flag.short_name or flag_name in flag.short_aliases):
-                if not flag.accepts_input or flag_value is None:
-                    flag_value = flag.default_value_present
-                token_object = FlagValue(flag, flag_value)
-                return token_object
+            name, _, value = input_flag.partition("=")
+            if value:
+                flag_name = name
+                flag_value = value
+
+        flag = None
+        if long_flag:
+            flag = self.long_flag_index.get(flag_name)
+        if flag is None:
+            flag = self.short_flag_index.get(flag_name)
+        if flag is None:
+            return None
+
+        if not flag.accepts_input or flag_value is None:
+            flag_value = flag.default_value_present
+        return FlagValue(flag, flag_value)
+
 
+    def invalidate_results(self):
+        """
+        Empties the result cache of the command, if it has one.
+        """
+        if self.result_cache is not None:
+            self.result_cache.clear()
 
     def run(self, *args, **kwargs):
         """
         Tries to run the self.function associated with the command.
         Takes in any amount of *args and **kwargs as input.
+        Raises a CommandArgumentsException without calling it if it does not accept them.
         If there is an exception, reraise it.
         """
+        self.check_arguments(len(args), kwargs)
         try:
             return self.function(*args, **kwargs)
         except Exception as e:
             raise e
             return None
 
+    async def run_async(self, *args, executor = None, **kwargs):
+        """
+        Tries to run the self.function associated with the command from an asyncio event loop.
+        Coroutine functions are awaited directly, while plain functions are run in
+        executor (or the event loop's default executor if it is None) so they do not block the loop.
+        Takes in any amount of *args and **kwargs as input.
+        Raises a CommandArgumentsException without calling it if it does not accept them.
+        """
+        self.check_arguments(len(args), kwargs)
+        if inspect.iscoroutinefunction(self.function):
+            return await self.function(*args, **kwargs)
+        
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(executor, functools.partial(self.function, *args, **kwargs))
+        if inspect.isawaitable(result):
+            result = await result
+        return result
@@ -1,118 +1,656 @@
-import shlex
-from .command import Command
-from .flag import Flag
-from .command_context import CommandContext, FlagValue
-from .exceptions import CommandNotRecognizedException
+import asyncio
+import functools
+import threading
+import time
+from .tokenizer import get_tokenizer, get_first_token, fast_tokenize, strip_span, TOKENIZERS, LEADING_WHITESPACE_PATTERN
+from .command import Command, FlagPool, build_command_index
+from .command_context import CommandContext, FlagValue, ParsePlan
+from .token_type import TokenType
+from .suggestions import SuggestionIndex
+from .instrumentation import Instrumentation, UNRECOGNIZED_COMMAND_PATH
+from .profiling import SlowCommandProfiler
+from .scheduler import DispatchScheduler
+from .server import CommandServer
+from .cache import LRUCache
+from .batch import parse_many
+from . import snapshot
+from .exceptions import CommandNotRecognizedException, DuplicateAliasException
+
+# Marks a result cache miss, since None is a valid result
+MISSING = object()
 
 class CommandCatalogue:
-    def __init__(self, commands_dict: dict):
+    def __init__(self, 
+        commands_dict: dict, 
+        tokenizer = "fast", 
+        prefix: str = None, 
+        ignore_unknown_commands: bool = False,
+        cache_size: int = 0,
+        executor = None,
+        max_concurrency: int = None,
+        lazy: bool = False,
+        global_flags: dict = None
+    ):
+        """
+        tokenizer is either the name of a built-in tokenizer ("fast" or "shlex")
+        or a callable that takes a string and returns a list of tokens.
+        prefix is an optional string (ie. "!") that every command message must start with.
+        Messages without it are not commands and parse returns its default for them.
+        If ignore_unknown_commands is True, parse also returns its default for messages whose
+        first word is not a command, instead of raising a CommandNotRecognizedException.
+        cache_size is the number of parsed messages to keep in an LRU cache, 0 disables it.
+        executor is the concurrent.futures.Executor that parse_async runs plain (non coroutine)
+        command functions in. If it is None, the event loop's default executor is used.
+        max_concurrency limits how many commands parse_async runs at the same time, None means no limit.
+        If lazy is True, sub commands are only built the first time a message descends into them,
+        so duplicate aliases in a sub command tree are only reported at that point.
+        global_flags is an optional dict of flags, in the same format as a command's flags,
+        that every command and sub command has. A command's own flag with the same name replaces it.
+        A command can also declare "inherited_flags", which it and all of its sub commands have.
+        Identical flag definitions are shared by every command that has them, see FlagPool.
+        """
         self.commands_dict = commands_dict
-        self.commands = self.get_commands_from_dict(self.commands_dict)
+        # The snapshot the catalogue was loaded from when its commands_dict is not known, see load_snapshot
+        self.snapshot_path = None
+        # The settings needed to rebuild this catalogue, ie. in a process pool worker
+        self.settings      = {
+            "tokenizer": tokenizer,
+            "prefix": prefix,
+            "ignore_unknown_commands": ignore_unknown_commands,
+            "cache_size": cache_size,
+            "lazy": lazy,
+            "global_flags": global_flags
+        }
+        self.tokenizer     = get_tokenizer(tokenizer)
+        self.prefix        = prefix
+        self.ignore_unknown_commands = ignore_unknown_commands
+        self.parse_cache   = LRUCache(cache_size) if cache_size > 0 else None
+        self.executor        = executor
+        self.max_concurrency = max_concurrency
+        # The (event loop, asyncio.Semaphore) that enforces max_concurrency, see get_async_semaphore
+        self.async_semaphore = None
+        self.lazy            = lazy
+        # Incremented every time the commands change, see publish_commands
+        self.generation      = 0
+        # Set by enable_instrumentation, parse only measures anything while it is not None
+        self.instrumentation = None
+        # Set by enable_profiling
+        self.profiler        = None
+        self.mutation_lock   = threading.Lock()
+        self.flag_pool       = FlagPool()
+        self.global_flags    = self.get_flags_from_dict(global_flags or {})
+        self.commands = self.get_commands_from_dict(self.commands_dict, self.global_flags)
+        self.index_commands()
+
+    def enable_instrumentation(self, instrumentation = None):
+        """
+        Starts recording the calls, errors, parse latency and run latency of every command in
+        instrumentation (a new Instrumentation if it is None), and returns it.
+        Use instrumentation.snapshot() or instrumentation.to_prometheus() to read what was recorded.
+        """
+        self.instrumentation = instrumentation if instrumentation is not None else Instrumentation()
+        return self.instrumentation
+
+    def disable_instrumentation(self):
+        self.instrumentation = None
+
+    def enable_profiling(self, threshold: float, **kwargs):
+        """
+        Starts sampling the stacks of command functions that run for longer than threshold seconds,
+        and returns the SlowCommandProfiler that keeps the captures (see SlowCommandProfiler for **kwargs).
+        Captures are rate limited and bounded in size, so profiling can be left on in production.
+        Only commands run by parse (and so parse_many) are watched, not those run by parse_async.
+        """
+        self.disable_profiling()
+        self.profiler = SlowCommandProfiler(threshold, **kwargs)
+        return self.profiler
+
+    def disable_profiling(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+        self.profiler = None
+
+    def create_scheduler(self, **kwargs):
+        """
+        Returns a DispatchScheduler that rate limits and prioritizes the commands of this catalogue
+        per caller, using the "cost", "priority" and "rate_limit" in each command's meta_data.
+        See DispatchScheduler for **kwargs.
+        """
+        return DispatchScheduler(self, **kwargs)
+
+    def create_server(self, **kwargs):
+        """
+        Returns a CommandServer that runs the messages sent to it over a TCP or Unix domain socket
+        through parse_async. See CommandServer for **kwargs, and start_tcp or start_unix to start it.
+        """
+        return CommandServer(self, **kwargs)
+
+    def save_snapshot(self, path: str):
+        """
+        Saves the built catalogue, with all of its lookup tables, to a snapshot file
+        that load_snapshot can load much faster than the catalogue can be built.
+        Raises a SnapshotException if a command function cannot be imported by its path.
+        """
+        snapshot.save_snapshot(self, path)
+
+    @classmethod
+    def load_snapshot(cls, path: str, commands_dict: dict = None, **kwargs):
+        """
+        Loads a catalogue saved by save_snapshot.
+        If commands_dict is given, raises a SnapshotOutdatedException if the snapshot was not
+        built from it, so that a stale snapshot is never used. Checking it takes a hash of
+        the whole dict, so pass None to skip the check when the snapshot is known to be current.
+        **kwargs are the settings that are not stored in snapshots, ie. executor and max_concurrency.
+        """
+        loaded = snapshot.load_snapshot(path, commands_dict)
+        catalogue = cls({}, **loaded["settings"], **kwargs)
+        catalogue.commands_dict = commands_dict
+        if commands_dict is None:
+            catalogue.snapshot_path = path
+        catalogue.publish_commands(loaded["commands"], loaded["command_index"])
+        return catalogue
+
+    def index_commands(self):
+        """
+        Builds the lookup table of top level command names and aliases.
+        Must be called again whenever self.commands changes.
+        """
+        self.publish_commands(self.commands, build_command_index(self.commands))
+
+    def publish_commands(self, commands: dict, command_index: dict):
+        """
+        Makes commands the top level commands of the catalogue.
+        Parses only look commands up through self.command_index, so replacing it
+        switches every new parse over to the new commands in one step. Plans built
+        from the old commands are not reused, since self.generation changes after it.
+        """
+        self.commands      = commands
+        self.command_index = command_index
+        self.suggestion_index = None
+        self.generation   += 1
+        self.invalidate_cache()
+
+    def register_command(self, path, command_dict: dict, replace: bool = False):
+        """
+        Adds a command, built from a dict of the same structure as the commands dict, to the catalogue.
+        path is the names of the command's parents and then its own name, either as a list
+        or as a string separated by spaces (ie. "queue list" adds the sub command list to queue).
+        Raises a DuplicateAliasException if the command already exists and replace is False,
+        or if its name or aliases clash with another command on the same level.
+        Only the commands along the path are copied and the catalogue is changed in one step,
+        so parses running on other threads at the same time see either the old or the new catalogue.
+        """
+        path = self.split_path(path)
+        name = path[-1]
+        new_command = self.get_commands_from_dict({name: command_dict}, self.get_inherited_flags(path[:-1]))[name]
+
+        def change(commands):
+            if name in commands and not replace:
+                raise DuplicateAliasException(f"The command '{' '.join(path)}' already exists.")
+            commands = dict(commands)
+            commands[name] = new_command
+            return commands
+
+        self.update_commands(path, change, command_dict)
+
+    def replace_command(self, path, command_dict: dict):
+        """
+        Replaces a command (and all of its sub commands), or adds it if it does not exist.
+        See register_command.
+        """
+        self.register_command(path, command_dict, replace = True)
+
+    def unregister_command(self, path):
+        """
+        Removes a command (and all of its sub commands) from the catalogue.
+        Raises a CommandNotRecognizedException if there is no command at path.
+        See register_command.
+        """
+        path = self.split_path(path)
+        name = path[-1]
+
+        def change(commands):
+            if name not in commands:
+                raise CommandNotRecognizedException(f"There is no command '{' '.join(path)}'.")
+            commands = dict(commands)
+            del commands[name]
+            return commands
+
+        self.update_commands(path, change, None)
+
+    def get_inherited_flags(self, parent_path: tuple):
+        """
+        Returns the global flags and the "inherited_flags" of every command along parent_path,
+        which a command added below it has. They are read from self.commands_dict,
+        so only the global flags are known if the catalogue was loaded from a snapshot without it.
+        """
+        inherited_flags = self.global_flags
+        input_dict = self.commands_dict or {}
+        for name in parent_path:
+            command_dict = input_dict.get(name, {})
+            inherited_flags = self.merge_flags(self.get_flags_from_dict(command_dict.get("inherited_flags", {})), inherited_flags)
+            input_dict = command_dict.get("sub_commands", {})
+        return inherited_flags
+
+    def split_path(self, path):
+        if isinstance(path, str):
+            path = path.split()
+        path = tuple(path)
+        if not path:
+            raise ValueError("The path of a command must have at least one name in it.")
+        return path
+
+    def update_commands(self, path: tuple, change, command_dict: dict):
+        """
+        Applies change to the commands dict that holds the command at path, copying each command
+        along the way instead of changing it, then publishes the new top level commands.
+        Also updates self.commands_dict the same way, so that snapshots and process pool workers
+        see the change. command_dict is the new definition, or None if the command is removed.
+        """
+        with self.mutation_lock:
+            commands = self.copy_path(self.commands, path[:-1], change)
+            command_index = build_command_index(commands)
+            if self.commands_dict is not None:
+                self.commands_dict = self.copy_dict_path(self.commands_dict, path, command_dict)
+            # A catalogue loaded without its commands dict no longer matches its snapshot
+            self.snapshot_path = None
+            self.publish_commands(commands, command_index)
+
+    def copy_path(self, commands: dict, parent_path: tuple, change):
+        if not parent_path:
+            return change(commands)
+        name = parent_path[0]
+        command = commands.get(name)
+        if command is None:
+            raise CommandNotRecognizedException(f"There is no command '{name}'.")
+        command.load_sub_commands()
+        commands = dict(commands)
+        commands[name] = command.with_sub_commands(self.copy_path(command.sub_commands, parent_path[1:], change))
+        return commands
+
+    def copy_dict_path(self, input_dict: dict, path: tuple, command_dict: dict):
+        input_dict = dict(input_dict or {})
+        name = path[0]
+        if len(path) == 1:
+            if command_dict is None:
+                input_dict.pop(name, None)
+            else:
+                input_dict[name] = command_dict
+            return input_dict
+        parent = dict(input_dict.get(name, {}))
+        parent["sub_commands"] = self.copy_dict_path(parent.get("sub_commands", {}), path[1:], command_dict)
+        input_dict[name] = parent
+        return input_dict
+
+    def invalidate_cache(self):
+        """
+        Empties the parse cache.
+        Must be called whenever a command, sub command or flag in the catalogue changes.
+        """
+        if getattr(self, "parse_cache", None) is not None:
+            self.parse_cache.clear()
+
+    def cache_info(self):
+        """
+        Returns a CacheInfo with the hits, misses and size of the parse cache,
+        or None if the cache is disabled.
+        """
+        if self.parse_cache is None:
+            return None
+        return self.parse_cache.info()
     
     
-    def get_commands_from_dict(self, input_dict):
+    def get_commands_from_dict(self, input_dict, inherited_flags: tuple = ()):
         """
         Parses a user-defined dict of a certain structure into a CommandsDefinition class.
+        inherited_flags are the Flags that every command in it has on top of its own.
         """
         commands = {}
         for command_name, command in input_dict.items():
+            command_inherited_flags = inherited_flags
+            if "inherited_flags" in command:
+                command_inherited_flags = self.merge_flags(self.get_flags_from_dict(command["inherited_flags"]), inherited_flags)
+            sub_commands_dict  = command.get("sub_commands", {})
+            sub_commands       = None
+            sub_command_loader = None
+            if self.lazy and sub_commands_dict:
+                sub_command_loader = functools.partial(self.get_commands_from_dict, sub_commands_dict, command_inherited_flags)
+            else:
+                sub_commands = self.get_commands_from_dict(sub_commands_dict, command_inherited_flags)
             commands[command_name] = Command(
                 name         = command_name, 
-                aliases      = command.get("aliases", []),
+                aliases      = command.get("aliases", ()),
                 description  = command.get("description", ""),
                 function     = command.get("function", None),
-                flags        = self.get_flags_from_dict(command.get("flags", {})),
-                sub_commands = self.get_commands_from_dict(command.get("sub_commands", {})),
-                meta_data    = command.get("meta_data", {})
+                flags        = self.merge_flags(self.get_flags_from_dict(command.get("flags", {})), command_inherited_flags),
+                sub_commands = sub_commands,
+                meta_data    = command.get("meta_data", None),
+                sub_command_loader = sub_command_loader,
+                result_cache = self.get_result_cache_from_dict(command.get("cache", None)),
+                flag_pool    = self.flag_pool
             )
         return commands
     
+    def merge_flags(self, flags: tuple, inherited_flags: tuple):
+        """
+        Returns flags followed by the inherited_flags that do not have the same long name as one of them.
+        """
+        if not inherited_flags:
+            return flags
+        if not flags:
+            return inherited_flags
+        names = {flag.long_name for flag in flags}
+        return flags + tuple(flag for flag in inherited_flags if flag.long_name not in names)
     
+    def get_result_cache_from_dict(self, cache):
+        """
+        Parses the optional "cache" entry of a command into an LRUCache for its results.
+        It is either True, or a dict with an optional "ttl" in seconds (default: no expiry)
+        and an optional "max_size" (default: 128).
+        """
+        if not cache:
+            return None
+        if cache is True:
+            cache = {}
+        return LRUCache(cache.get("max_size", 128), cache.get("ttl", None))
+
     def get_flags_from_dict(self, input_dict_flags):
         """
-        Parses a user-defined dict of flags into a list of Flags.
+        Parses a user-defined dict of flags into a tuple of Flags, shared through self.flag_pool.
         """
         flags = []
         for flag_name, flag in input_dict_flags.items():
-            flags.append(Flag(
+            flags.append(self.flag_pool.get_flag(
                 long_name     = flag_name,
-                long_aliases  = flag.get("long_aliases", []),
+                long_aliases  = flag.get("long_aliases", ()),
                 short_name    = flag.get("short_name", None),
-                short_aliases = flag.get("short_aliases", []),
+                short_aliases = flag.get("short_aliases", ()),
                 accepts_input = flag.get("accepts_input", False),
                 default_value_present = flag.get("default_value_present", None),
                 default_value_absent  = flag.get("default_value_absent", None)
             ))
-        return flags
+        return tuple(flags)
 
 
-    def tokenize_string(self, string: str):
+    def tokenize_string(self, string: str, start: int = 0):
         """
         Takes a string and turns it into a list of tokens delimited by whitespace, 
         accounting for substrings.
+        Only string[start:] is tokenized. The fast tokenizer reads it in place,
+        so long messages are not copied before they are split.
         """
-        string = string.strip()
-        # shlex.split preserves substrings when it splits
-        tokens = shlex.split(string)
+        if self.tokenizer is fast_tokenize:
+            start, end = strip_span(string, start)
+            return fast_tokenize(string, start, end)
+        string = string[start:].strip()
+        # The tokenizer preserves substrings when it splits
+        tokens = self.tokenizer(string)
         return tokens
 
     
     def get_command(self, token):
-        if token in self.commands.keys():
-            return self.commands[token]
-        else:
-            for command in self.commands.values():
-                if token in command.aliases:
-                    return command
-        return None
+        return self.command_index.get(token)
+
+    def get_command_completions(self, prefix: str, limit: int = 10):
+        """
+        Returns up to limit command names and aliases that start with prefix.
+        """
+        return self.get_suggestion_index().get_completions(prefix, limit)
+
+    def get_command_suggestions(self, token: str, max_distance: int = 2, limit: int = 5):
+        """
+        Returns up to limit command names and aliases within max_distance edits of token, closest first.
+        """
+        return self.get_suggestion_index().get_suggestions(token, max_distance, limit)
+
+    def get_suggestion_index(self):
+        """
+        Returns the SuggestionIndex of the top level commands, building it the first time it is needed,
+        since most catalogues that never see an unknown command do not need one.
+        """
+        command_index = self.command_index
+        suggestion_index = self.suggestion_index
+        if suggestion_index is None:
+            suggestion_index = SuggestionIndex(command_index.keys())
+            # Only keep it if the commands did not change while it was being built
+            if command_index is self.command_index:
+                self.suggestion_index = suggestion_index
+        return suggestion_index
+
+    def command_not_recognized(self, token: str):
+        """
+        Returns a CommandNotRecognizedException for an unknown token.
+        Its suggestions are only looked up if they are read.
+        """
+        return CommandNotRecognizedException(
+            f"'{token}' is not a command.",
+            token = token,
+            suggestion_source = functools.partial(self.get_command_suggestions, token)
+        )
+
+    def get_command_start(self, message: str):
+        """
+        Cheaply checks if a message is a command before it is tokenized.
+        Returns the index in the message after its prefix, or None if the message is not a command.
+        Only the prefix and the first word of the message are looked at, so long
+        messages that are not commands are never fully tokenized.
+        """
+        start = LEADING_WHITESPACE_PATTERN.match(message).end()
+        if self.prefix:
+            if not message.startswith(self.prefix, start):
+                return None
+            start += len(self.prefix)
+        
+        # Custom tokenizers may not split on whitespace, so only the built-in ones are prechecked
+        if self.tokenizer in TOKENIZERS.values():
+            first_token = get_first_token(message, start)
+            if first_token == "":
+                return None
+            if first_token is not None and self.get_command(first_token) is None:
+                if self.ignore_unknown_commands:
+                    return None
+                raise self.command_not_recognized(first_token)
+        
+        return start
 
     def classify_tokens(self, message: str):
         """
         Takes an input string or "message" and returns two lists:
-        -   A list of token types (token_types): ie. Command, Sub Command, Flag, Argument
+        -   A list of token types (token_types): TokenType.COMMAND, SUB_COMMAND, FLAG or ARGUMENT
         -   A list of token objects (token_objects): ie. Command (class), 
             Flags (just long name) and their values, and Arguments
         """
+        token_types, token_objects, _, _, arguments = self.resolve_tokens(message)
+        return (token_types + (TokenType.ARGUMENT,) * len(arguments), token_objects + arguments)
 
-        tokens = self.tokenize_string(message)
-        token_types = []
-        token_objects = []
+    def resolve_tokens(self, message: str):
+        """
+        Classifies the tokens of a message in a single forward pass and returns:
+        -   The token types and token objects of the command, sub command and flag tokens
+        -   The last Command or sub command in the message, or None if the message is not a command
+        -   A list of the FlagValues in the message
+        -   A tuple of the Arguments, which are every token after the last flag or sub command
+        """
+        start = self.get_command_start(message)
+        if start is None:
+            return ((), (), None, [], ())
 
-        last_command = None
-        for token in tokens:
-            if "Command" not in token_types:
-                command = self.get_command(token)
-                if command is not None:
-                    token_types.append("Command")
-                    token_objects.append(command)
-                    last_command = command
-                    continue
-                else:
-                    raise CommandNotRecognizedException
-            
-            token_type_last = token_types[-1]
-            token_object_last = token_objects[-1]
+        tokens = self.tokenize_string(message, start)
+        if not tokens:
+            return ((), (), None, [], ())
 
-            if token_type_last in ["Command", "Sub Command"]:
-                sub_command = token_object_last.get_sub_command(token)
+        last_command = self.get_command(tokens[0])
+        if last_command is None:
+            if self.ignore_unknown_commands:
+                return ((), (), None, [], ())
+            raise self.command_not_recognized(tokens[0])
+
+        token_types = [TokenType.COMMAND]
+        token_objects = [last_command]
+        flag_values = []
+        arguments = ()
+        # Sub commands may only follow a command or another sub command, not a flag
+        accepts_sub_command = True
+
+        for index in range(1, len(tokens)):
+            token = tokens[index]
+
+            if accepts_sub_command:
+                sub_command = last_command.get_sub_command(token)
                 if sub_command is not None:
-                    token_types.append("Sub Command")
+                    token_types.append(TokenType.SUB_COMMAND)
                     token_objects.append(sub_command)
                     last_command = sub_command
                     continue
             
-            if token_type_last in ["Command", "Sub Command", "Flag"]:
-                flag = last_command.get_flag(token)
-                if flag is not None:
-                    token_types.append("Flag")
-                    token_objects.append(flag)
-                    continue
+            flag = last_command.get_flag(token)
+            if flag is not None:
+                token_types.append(TokenType.FLAG)
+                token_objects.append(flag)
+                flag_values.append(flag)
+                accepts_sub_command = False
+                continue
             
-            token_types.append("Argument")
-            token_objects.append(token)
-            continue
+            # Everything from the first argument onwards is an argument
+            arguments = tuple(tokens[index:])
+            break
         
-        return (tuple(token_types), tuple(token_objects))
+        return (tuple(token_types), tuple(token_objects), last_command, flag_values, arguments)
+
+    def get_parse_plan(self, message: str):
+        """
+        Returns the ParsePlan for a message, reusing a cached one if possible.
+        Returns None if the message is not a command.
+        """
+        if self.parse_cache is not None:
+            plan = self.parse_cache.get(message)
+            if plan is not None and plan.generation == self.generation:
+                return plan
+
+        plan = self.build_parse_plan(message)
+        if plan is not None and self.parse_cache is not None:
+            self.parse_cache.put(message, plan)
+        return plan
+
+    def build_parse_plan(self, message: str):
+        """
+        Classifies the tokens of a message and resolves the command to run,
+        its flags and its positional arguments into a ParsePlan.
+        Returns None if the message is not a command.
+        """
+        # Read before the tokens are resolved, so a plan is never marked newer than the commands it used
+        generation = self.generation
+        token_types, token_objects, run_command, flag_values, arguments = self.resolve_tokens(message)
+
+        # If there is no command found, there is nothing to run
+        if run_command is None:
+            return None
+
+        # Start from the default values of the flags for when they are absent
+        flags = run_command.flag_defaults.copy()
+
+        # Populate the flags dict with their values (default or inputted) if they are present
+        for flag_value_pair in flag_values:
+            flags[flag_value_pair.flag.long_name] = flag_value_pair
+
+        return ParsePlan(
+            run_command,
+            flags = flags,
+            arguments = arguments,
+            head_tokens = token_objects,
+            head_token_types = token_types,
+            generation = generation
+        )
+
+    def get_result_key(self, plan, args: tuple, kwargs: dict):
+        """
+        Returns the key that the result of running a plan is cached under:
+        its positional arguments, its flag values and the extra *args and **kwargs.
+        Returns None if any of them cannot be hashed, so the result is not cached.
+        """
+        flag_values = tuple(
+            (name, value.value if isinstance(value, FlagValue) else value) 
+            for name, value in plan.flags.items()
+        )
+        key = (plan.arguments, flag_values, args, tuple(sorted(kwargs.items())) if kwargs else ())
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def run_command(self, plan, context, args: tuple, kwargs: dict, profiler = None):
+        """
+        Runs the command of a plan, watched by profiler if it is not None.
+        """
+        if profiler is None:
+            return plan.command.run(*args, *plan.arguments, context = context, **kwargs)
+        with profiler.watch(plan, context):
+            return plan.command.run(*args, *plan.arguments, context = context, **kwargs)
+
+    def run_cached(self, plan, context, args: tuple, kwargs: dict, profiler = None):
+        """
+        Returns the cached result of a cacheable command for the plan's arguments and flags,
+        or runs it (watched by profiler if it is not None) and caches the result.
+        """
+        result_cache = plan.command.result_cache
+        key = self.get_result_key(plan, args, kwargs)
+        if key is not None:
+            result = result_cache.get(key, MISSING)
+            if result is not MISSING:
+                return result
+        result = self.run_command(plan, context, args, kwargs, profiler)
+        if key is not None:
+            result_cache.put(key, result)
+        return result
+
+    def get_result_cache_info(self, path):
+        """
+        Returns a CacheInfo with the hits, misses, evictions and expirations of the result cache
+        of the command at path (see register_command), or None if it is not cacheable.
+        """
+        command = self.get_command_at_path(path)
+        if command.result_cache is None:
+            return None
+        return command.result_cache.info()
+
+    def invalidate_results(self, path = None):
+        """
+        Empties the result cache of the command at path (see register_command),
+        or of every cacheable command in the catalogue if path is None.
+        """
+        if path is not None:
+            self.get_command_at_path(path).invalidate_results()
+            return
+        commands = list(self.commands.values())
+        while commands:
+            command = commands.pop()
+            command.invalidate_results()
+            # Sub commands that were never built cannot have cached anything
+            if command.sub_command_loader is None:
+                commands.extend(command.sub_commands.values())
+
+    def get_command_at_path(self, path):
+        """
+        Returns the command at a path of command names, see register_command.
+        Raises a CommandNotRecognizedException if there is none.
+        """
+        path = self.split_path(path)
+        commands = self.commands
+        for name in path:
+            command = commands.get(name)
+            if command is None:
+                raise CommandNotRecognizedException(f"There is no command '{' '.join(path)}'.")
+            command.load_sub_commands()
+            commands = command.sub_commands
+        return command
+
+    def build_context(self, plan, message: str):
+        """
+        Creates a CommandContext from a ParsePlan that will be passed to the command's function for it to consume.
+        Its flags, tokens and token_types are built from the plan when they are first read.
+        """
+        return CommandContext(plan.command, message_raw = message, plan = plan)
 
     def parse(self, message: str, default = None, *args, **kwargs):
         """
@@ -121,45 +659,155 @@ class CommandCatalogue:
         Also accepts *args and **kwargs and passes it through to the command's 
         function being run.
         """
-        token_types, token_objects = self.classify_tokens(message)
-        run_command = None
-        arguments = []
-        flags = {}
+        if self.instrumentation is not None or self.profiler is not None:
+            return self.parse_observed(message, default, args, kwargs)
+
+        plan = self.get_parse_plan(message)
 
-        # Find last occurence of a command or sub command in the message
-        if "Command" in token_types:
-            i = max((index for index, val in enumerate(token_types) if (val == "Command" or val == "Sub Command")), default=None)
-            run_command = token_objects[i]
         # If there is no command found, return a default value
-        else:
+        if plan is None:
+            return default
+        
+        context = self.build_context(plan, message)
+        if plan.command.result_cache is not None:
+            return self.run_cached(plan, context, args, kwargs)
+        return plan.command.run(*args, *plan.arguments, context = context, **kwargs)
+
+    def parse_observed(self, message: str, default, args, kwargs):
+        """
+        parse, while timing the parse phase and the run phase separately for self.instrumentation,
+        and watching the run phase with self.profiler.
+        """
+        instrumentation = self.instrumentation
+        start = time.perf_counter()
+        try:
+            plan = self.get_parse_plan(message)
+        except Exception:
+            if instrumentation is not None:
+                instrumentation.record(UNRECOGNIZED_COMMAND_PATH, time.perf_counter() - start, None, True)
+            raise
+
+        if plan is None:
             return default
 
-        # Populate the flags dict with the default values if the flags are absent
-        for flag in run_command.flags:
-            flags[flag.long_name] = flag.default_value_absent
+        return self.run_plan(plan, message, args, kwargs, time.perf_counter() - start)
 
-        # Populate the flags dict with their values (default or inputted) if they are present
-        for k in range(len(token_types)):
-            if token_types[k] == "Flag":
-                flag_value_pair = token_objects[k]
-                flag_name = flag_value_pair.flag.long_name
-                flags[flag_name] = flag_value_pair
-
-        # The rest of the tokens are assumed to be argumments
-        if "Argument" in token_types:
-            j = token_types.index("Argument")
-            arguments = token_objects[j:]
+    def run_plan(self, plan, message: str, args: tuple, kwargs: dict, parse_seconds: float = 0.0):
+        """
+        Runs the command of a plan resolved from message the way parse does: through its result cache,
+        watched by self.profiler and recorded by self.instrumentation.
+        parse_seconds is how long resolving the plan took, for self.instrumentation.
+        """
+        instrumentation = self.instrumentation
+        context = self.build_context(plan, message)
+        run_start = time.perf_counter()
+        error = True
+        try:
+            if plan.command.result_cache is not None:
+                result = self.run_cached(plan, context, args, kwargs, self.profiler)
+            else:
+                result = self.run_command(plan, context, args, kwargs, self.profiler)
+            error = False
+            return result
+        finally:
+            if instrumentation is not None:
+                instrumentation.record(plan.get_command_path(), parse_seconds, time.perf_counter() - run_start, error)
+
+    async def parse_async(self, message: str, default = None, *args, **kwargs):
+        """
+        The asyncio version of parse.
+        Coroutine command functions are awaited, plain ones are run in self.executor.
+        At most self.max_concurrency commands are run at the same time.
+        """
+        instrumentation = self.instrumentation
+        start = time.perf_counter() if instrumentation is not None else None
+        try:
+            plan = self.get_parse_plan(message)
+        except Exception:
+            if instrumentation is not None:
+                instrumentation.record(UNRECOGNIZED_COMMAND_PATH, time.perf_counter() - start, None, True)
+            raise
+
+        # If there is no command found, return a default value
+        if plan is None:
+            return default
         
-        # Creates a CommandContext that will be passed to the command's function for it to consume
-        context = CommandContext(
-            run_command,
-            flags = flags,
-            tokens = token_objects,
-            token_types = token_types,
-            message_raw = message
-        )
+        context = self.build_context(plan, message)
+        if self.max_concurrency is None:
+            return await self.run_async(plan, context, args, kwargs, instrumentation, start)
+        
+        async with self.get_async_semaphore():
+            return await self.run_async(plan, context, args, kwargs, instrumentation, start)
 
-        if run_command is not None:
-            return run_command.run(*args, *arguments, context = context, **kwargs)
-        else:
-            raise CommandNotRecognizedException
\ No newline at end of file
+    def get_async_semaphore(self):
+        """
+        Returns the semaphore that limits parse_async to self.max_concurrency commands at a time.
+        A semaphore can only be used from the event loop it was first used in, so a new one
+        is created whenever parse_async runs in a different loop (ie. after a second asyncio.run).
+        """
+        loop = asyncio.get_running_loop()
+        async_semaphore = self.async_semaphore
+        if async_semaphore is None or async_semaphore[0] is not loop:
+            async_semaphore = self.async_semaphore = (loop, asyncio.Semaphore(self.max_concurrency))
+        return async_semaphore[1]
+
+    async def run_async(self, plan, context, args, kwargs, instrumentation, start):
+        """
+        Runs the command of a plan for parse_async, timing it if instrumentation is not None.
+        Time spent waiting for the concurrency limit is not counted in either phase.
+        """
+        if instrumentation is None:
+            return await self.run_command_async(plan, context, args, kwargs)
+
+        parse_seconds = time.perf_counter() - start
+        run_start = time.perf_counter()
+        error = True
+        try:
+            result = await self.run_command_async(plan, context, args, kwargs)
+            error = False
+            return result
+        finally:
+            instrumentation.record(plan.get_command_path(), parse_seconds, time.perf_counter() - run_start, error)
+
+    async def run_command_async(self, plan, context, args: tuple, kwargs: dict):
+        """
+        The asyncio version of running a plan's command, using its result cache like run_cached.
+        """
+        result_cache = plan.command.result_cache
+        key = self.get_result_key(plan, args, kwargs) if result_cache is not None else None
+        if key is not None:
+            result = result_cache.get(key, MISSING)
+            if result is not MISSING:
+                return result
+        result = await plan.command.run_async(*args, *plan.arguments, context = context, executor = self.executor, **kwargs)
+        if key is not None:
+            result_cache.put(key, result)
+        return result
+
+    def parse_many(self, messages, default = None, *args,
+        executor = "thread",
+        max_workers: int = None,
+        ordered: bool = True,
+        max_pending: int = None,
+        **kwargs
+    ):
+        """
+        Parses every message of an iterable (ie. a list, a generator or the lines of a file)
+        and yields a ParseResult for each one, holding either the command's return value or
+        the exception it raised, so that one bad message does not stop the batch.
+        -   executor is "thread", "process" or a concurrent.futures.Executor to run the commands in.
+            With "process", each worker builds its own copy of the catalogue from self.commands_dict,
+            so the command functions, arguments and return values must be picklable.
+            A ProcessPoolExecutor cannot be passed, since the catalogue itself cannot be sent to it.
+        -   max_workers is the size of the pool created for "thread" or "process".
+        -   If ordered is True, results are yielded in the order of the messages,
+            otherwise they are yielded as soon as they complete.
+        -   max_pending is how many messages may be in flight at once.
+        *args and **kwargs are passed through to every command's function, like in parse.
+        """
+        return parse_many(self, messages, default, args, kwargs,
+            executor = executor,
+            max_workers = max_workers,
+            ordered = ordered,
+            max_pending = max_pending
+        )
@@ -1,22 +1,64 @@
+from .token_type import TokenType
+
+
 class CommandContext:
     """
     The CommandContext class bundles useful information about the execution of a command.
+    When it is created from a ParsePlan, flags, tokens and token_types are only built
+    the first time they are read, since most command functions never look at them.
     """
+    __slots__ = ("command", "message_raw", "plan", "materialized_flags", "materialized_tokens", "materialized_token_types")
+
     def __init__(self,
         command,
-        flags       = {},
-        tokens      = (),
-        token_types = (),
-        message_raw = None
+        flags       = None,
+        tokens      = None,
+        token_types = None,
+        message_raw = None,
+        plan        = None
     ):
         self.command     = command
-        self.flags       = flags
-        self.tokens      = tokens
-        self.token_types = token_types
         self.message_raw = message_raw
+        self.plan        = plan
+        self.materialized_flags       = flags if flags is not None or plan is not None else {}
+        self.materialized_tokens      = tokens if tokens is not None or plan is not None else ()
+        self.materialized_token_types = token_types if token_types is not None or plan is not None else ()
+
+    @property
+    def flags(self):
+        # A copy, so that a command function changing it does not change the cached plan
+        if self.materialized_flags is None:
+            self.materialized_flags = dict(self.plan.flags)
+        return self.materialized_flags
+
+    @flags.setter
+    def flags(self, flags):
+        self.materialized_flags = flags
+
+    @property
+    def tokens(self):
+        if self.materialized_tokens is None:
+            self.materialized_tokens = self.plan.tokens
+        return self.materialized_tokens
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self.materialized_tokens = tokens
+
+    @property
+    def token_types(self):
+        if self.materialized_token_types is None:
+            self.materialized_token_types = self.plan.token_types
+        return self.materialized_token_types
+
+    @token_types.setter
+    def token_types(self, token_types):
+        self.materialized_token_types = token_types
 
 
 class FlagValue:
+    __slots__ = ("flag", "value")
+
     def __init__(self,
         flag,
         value
@@ -25,4 +67,50 @@ class FlagValue:
         self.value = value
 
     def __repr__(self):
-        return f"Flag: {self.flag}, Value: {self.value}"
\ No newline at end of file
+        return f"Flag: {self.flag}, Value: {self.value}"
+
+
+class ParsePlan:
+    """
+    The ParsePlan class holds everything that parse resolves from a message
+    before it runs a command, so that it can be cached and reused for the same message.
+    head_tokens and head_token_types are the command, sub command and flag tokens, which
+    are followed by the arguments. The full tokens and token_types are built from them on demand.
+    """
+    __slots__ = ("command", "flags", "arguments", "head_tokens", "head_token_types", "generation", "command_path")
+
+    def __init__(self,
+        command,
+        flags            = None,
+        arguments        = (),
+        head_tokens      = (),
+        head_token_types = (),
+        generation       = 0
+    ):
+        self.command          = command
+        self.flags            = flags if flags is not None else {}
+        self.arguments        = arguments
+        self.head_tokens      = head_tokens
+        self.head_token_types = head_token_types
+        # The CommandCatalogue.generation the plan was built in, so that it is not reused once the catalogue changes
+        self.generation       = generation
+        self.command_path     = None
+
+    @property
+    def tokens(self):
+        return self.head_tokens + self.arguments
+
+    @property
+    def token_types(self):
+        return self.head_token_types + (TokenType.ARGUMENT,) * len(self.arguments)
+
+    def get_command_path(self):
+        """
+        Returns the names of the command and sub commands in the message, separated by spaces (ie. "queue list").
+        """
+        if self.command_path is None:
+            self.command_path = " ".join(
+                token.name for token, token_type in zip(self.head_tokens, self.head_token_types)
+                if token_type is TokenType.COMMAND or token_type is TokenType.SUB_COMMAND
+            )
+        return self.command_path
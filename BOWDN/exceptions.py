@@ -8,9 +8,79 @@ class CommandFunctionNotAssignedException(Exception):
     """
     pass
 
+class CommandArgumentsException(TypeError):
+    """
+    Raised before a command's function is run when it does not accept
+    the arguments it would be called with, ie. too many positional arguments.
+    command_name is the name of the command that was being run.
+    It is a TypeError, which is what calling the function would have raised.
+    """
+    def __init__(self, *args, command_name: str = None):
+        super().__init__(*args)
+        self.command_name = command_name
+
 class CommandNotRecognizedException(Exception):
     """
     Raised when the command inputed by the user is not a command
     in the CommandCatalogue.
+    token is the unrecognized token, and suggestions are the closest
+    command names and aliases to it, closest first.
+    Finding suggestions is much slower than rejecting a message, so they can instead be given
+    as suggestion_source, a function that returns them, which is only called when they are first read.
+    """
+    def __init__(self, *args, token: str = None, suggestions: list = (), suggestion_source = None):
+        super().__init__(*args)
+        self.token = token
+        self.suggestion_source = suggestion_source
+        self.materialized_suggestions = None if suggestion_source is not None else list(suggestions)
+
+    @property
+    def suggestions(self):
+        if self.materialized_suggestions is None:
+            self.materialized_suggestions = list(self.suggestion_source())
+            self.suggestion_source = None
+        return self.materialized_suggestions
+
+    def __reduce__(self):
+        # The suggestion source usually holds a whole catalogue, so only its suggestions are pickled
+        return (type(self), self.args, {"token": self.token, "suggestion_source": None, "materialized_suggestions": self.suggestions})
+
+class DuplicateAliasException(Exception):
+    """
+    Raised when two different commands, sub commands or flags
+    on the same level share a name or an alias.
+    """
+    pass
+
+
+class SnapshotException(Exception):
+    """
+    Raised when a CommandCatalogue snapshot cannot be saved or loaded,
+    ie. when a command function cannot be imported by its path.
     """
-    pass
\ No newline at end of file
+    pass
+
+class SnapshotOutdatedException(SnapshotException):
+    """
+    Raised when a CommandCatalogue snapshot was not built
+    from the commands dict it is being loaded for.
+    """
+    pass
+
+class CommandRejectedException(Exception):
+    """
+    Raised by a DispatchTicket when the DispatchScheduler rejected its command
+    instead of running it, ie. because the caller went over its rate limit.
+    reason says why, and retry_after is the number of seconds after which
+    the same call would be accepted, if known.
+    """
+    def __init__(self, *args, reason: str = None, retry_after: float = None):
+        super().__init__(*args)
+        self.reason      = reason
+        self.retry_after = retry_after
+
+class FrameTooLargeException(ValueError):
+    """
+    Raised when a request sent to a CommandServer is longer than its max_message_size.
+    """
+    pass
@@ -1,24 +1,53 @@
 """
 The Flag class defines all the components of a flag.
 Each Command can have any number of Flags.
+A Flag cannot be changed once it is created.
 """
 class Flag:
+    __slots__ = (
+        "long_name", 
+        "long_aliases", 
+        "short_name", 
+        "short_aliases", 
+        "accepts_input", 
+        "default_value_present", 
+        "default_value_absent"
+    )
+
     def __init__(self, 
             long_name: str, 
-            long_aliases: list    = None, 
+            long_aliases: tuple   = (), 
             short_name: str       = None, 
-            short_aliases: list   = None, 
+            short_aliases: tuple  = (), 
             accepts_input         = False,
             default_value_present = None,
             default_value_absent  = None
         ):
-        self.long_name     = long_name
-        self.long_aliases  = long_aliases
-        self.short_name    = short_name
-        self.short_aliases = short_aliases
-        self.accepts_input = accepts_input
-        self.default_value_present = default_value_present
-        self.default_value_absent  = default_value_absent
+        set_attribute = object.__setattr__
+        set_attribute(self, "long_name",     long_name)
+        set_attribute(self, "long_aliases",  tuple(long_aliases or ()))
+        set_attribute(self, "short_name",    short_name)
+        set_attribute(self, "short_aliases", tuple(short_aliases or ()))
+        set_attribute(self, "accepts_input", accepts_input)
+        set_attribute(self, "default_value_present", default_value_present)
+        set_attribute(self, "default_value_absent",  default_value_absent)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Flag {self.long_name} cannot be changed.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Flag {self.long_name} cannot be changed.")
+
+    def __reduce__(self):
+        return (Flag, (
+            self.long_name, 
+            self.long_aliases, 
+            self.short_name, 
+            self.short_aliases, 
+            self.accepts_input, 
+            self.default_value_present, 
+            self.default_value_absent
+        ))
     
     def __repr__(self):
-        return self.long_name
\ No newline at end of file
+        return self.long_name
@@ -0,0 +1,151 @@
+"""
+Records, per command path (ie. "queue list"), how many times each command was run,
+how many times it raised, and histograms of how long parsing and running it took.
+"""
+import bisect
+import threading
+
+
+# Upper bounds of the latency histogram buckets, in seconds
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+# The command path that messages which could not be parsed into a command are recorded under
+UNRECOGNIZED_COMMAND_PATH = "<unrecognized>"
+
+
+class Histogram:
+    """
+    A latency histogram with fixed bucket upper bounds.
+    counts[i] is the number of observations in bucket i, and the last count
+    is the number of observations above every bound.
+    """
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum    = 0.0
+        self.count  = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+    def snapshot(self):
+        """
+        Returns the histogram as a dict with cumulative bucket counts, like Prometheus.
+        """
+        buckets = []
+        total = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            buckets.append((bound, total))
+        return {"buckets": buckets, "sum": self.sum, "count": self.count}
+
+
+class CommandStats:
+    """
+    The CommandStats class holds everything recorded for one command path.
+    parse_latency covers tokenizing, classifying and building the CommandContext,
+    and run_latency covers running the command's function.
+    """
+    __slots__ = ("calls", "errors", "parse_latency", "run_latency")
+
+    def __init__(self, bounds: tuple = DEFAULT_BUCKETS):
+        self.calls  = 0
+        self.errors = 0
+        self.parse_latency = Histogram(bounds)
+        self.run_latency   = Histogram(bounds)
+
+
+class Instrumentation:
+    """
+    Collects CommandStats for a CommandCatalogue, see CommandCatalogue.enable_instrumentation.
+    Any object with a record method that takes the same arguments can be used in its place,
+    ie. to forward measurements to another metrics library.
+    """
+    def __init__(self, bounds: tuple = DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.stats  = {}
+        self.lock   = threading.Lock()
+
+    def record(self, command_path: str, parse_seconds: float, run_seconds: float = None, error: bool = False):
+        """
+        Records one parse of a message.
+        run_seconds is None if the message failed to parse, so its command was never run.
+        """
+        with self.lock:
+            stats = self.stats.get(command_path)
+            if stats is None:
+                stats = self.stats[command_path] = CommandStats(self.bounds)
+            stats.calls += 1
+            if error:
+                stats.errors += 1
+            stats.parse_latency.observe(parse_seconds)
+            if run_seconds is not None:
+                stats.run_latency.observe(run_seconds)
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def snapshot(self):
+        """
+        Returns a dict of {command path: {"calls", "errors", "parse_latency", "run_latency"}},
+        where the latencies are histogram snapshots. It is a copy, so it does not change afterwards.
+        """
+        with self.lock:
+            return {
+                command_path: {
+                    "calls":  stats.calls,
+                    "errors": stats.errors,
+                    "parse_latency": stats.parse_latency.snapshot(),
+                    "run_latency":   stats.run_latency.snapshot()
+                }
+                for command_path, stats in self.stats.items()
+            }
+
+    def to_prometheus(self, prefix: str = "bowdn"):
+        """
+        Returns the recorded stats in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = []
+
+        for name, key, help_text in (
+            ("command_calls_total",  "calls",  "Number of messages parsed for each command."),
+            ("command_errors_total", "errors", "Number of messages for each command that raised an exception.")
+        ):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} counter")
+            for command_path, stats in snapshot.items():
+                lines.append(f'{prefix}_{name}{{command="{escape_label(command_path)}"}} {stats[key]}')
+
+        for name, key, help_text in (
+            ("command_parse_seconds", "parse_latency", "Time spent parsing messages for each command."),
+            ("command_run_seconds",   "run_latency",   "Time spent running each command's function.")
+        ):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            for command_path, stats in snapshot.items():
+                label = f'command="{escape_label(command_path)}"'
+                histogram = stats[key]
+                for bound, count in histogram["buckets"]:
+                    lines.append(f'{prefix}_{name}_bucket{{{label},le="{format_bound(bound)}"}} {count}')
+                lines.append(f"{prefix}_{name}_sum{{{label}}} {histogram['sum']}")
+                lines.append(f"{prefix}_{name}_count{{{label}}} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_bound(bound: float):
+    return "+Inf" if bound == float("inf") else repr(bound)
@@ -0,0 +1,244 @@
+"""
+Captures where slow command functions spend their time.
+
+While a command runs, a background thread checks how long it has been running.
+Once it passes the threshold, the thread samples the command's stack every
+sample_interval seconds until it returns, and the samples are saved as a
+SlowCommandCapture along with the message and its CommandContext.
+Commands that finish under the threshold are never sampled, so the cost of
+leaving it on is registering and unregistering each run.
+"""
+import collections
+import contextlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+
+class SlowCommandCapture:
+    """
+    The SlowCommandCapture class holds the stack samples taken while one slow command ran.
+    samples maps a stack (a tuple of "file:line function" strings, outermost first)
+    to the number of times it was seen, so the most common stacks are where the time went.
+    """
+    __slots__ = ("message", "command_path", "metadata", "started", "duration", "sample_interval", "samples")
+
+    def __init__(self, message: str, command_path: str, metadata: dict, started: float, sample_interval: float):
+        self.message         = message
+        self.command_path    = command_path
+        self.metadata        = metadata
+        self.started         = started
+        self.duration        = None
+        self.sample_interval = sample_interval
+        self.samples         = collections.Counter()
+
+    def top_stacks(self, limit: int = 10):
+        """
+        Returns the limit most sampled stacks with how many times each was seen.
+        """
+        return self.samples.most_common(limit)
+
+    def to_dict(self):
+        return {
+            "message":         self.message,
+            "command_path":    self.command_path,
+            "metadata":        self.metadata,
+            "started":         self.started,
+            "duration":        self.duration,
+            "sample_interval": self.sample_interval,
+            "samples": [{"count": count, "stack": list(stack)} for stack, count in self.samples.most_common()]
+        }
+
+
+class ActiveRun:
+    __slots__ = ("thread_id", "start", "plan", "context", "capture", "skipped", "finished")
+
+    def __init__(self, thread_id: int, start: float, plan, context):
+        self.thread_id = thread_id
+        self.start     = start
+        self.plan      = plan
+        self.context   = context
+        self.capture   = None
+        # Set when the run passed the threshold but the rate limit did not allow a capture
+        self.skipped   = False
+        # Set under the profiler's lock once the command has returned, so no capture is started after it
+        self.finished  = False
+
+
+class SlowCommandProfiler:
+    """
+    Samples the stacks of command functions that run for longer than threshold seconds.
+    See CommandCatalogue.enable_profiling.
+    -   sample_interval is the number of seconds between two samples of a slow run.
+    -   min_capture_interval is the minimum number of seconds between the start of two captures,
+        so that a burst of slow commands does not turn into a burst of profiling.
+    -   max_captures is how many captures are kept in memory, the oldest are dropped first.
+    -   max_samples, max_stack_depth and max_message_length limit the size of each capture.
+    -   If directory is given, every capture is also written to it as a JSON file,
+        keeping at most max_files of them. Files that cannot be written are counted in
+        failed_writes instead of failing the command.
+    Call stop once the profiler is no longer used, to stop its sampler thread.
+    """
+    def __init__(self,
+        threshold: float,
+        sample_interval: float      = 0.005,
+        min_capture_interval: float = 60.0,
+        max_captures: int           = 20,
+        max_samples: int            = 1000,
+        max_stack_depth: int        = 50,
+        max_message_length: int     = 1000,
+        directory: str              = None,
+        max_files: int              = 100
+    ):
+        self.threshold            = threshold
+        self.sample_interval      = sample_interval
+        self.min_capture_interval = min_capture_interval
+        self.max_samples          = max_samples
+        self.max_stack_depth      = max_stack_depth
+        self.max_message_length   = max_message_length
+        self.directory            = directory
+        self.max_files            = max_files
+        self.captures             = collections.deque(maxlen = max_captures)
+        self.skipped_captures     = 0
+        self.failed_writes        = 0
+        self.last_capture_start   = None
+        self.stopped              = False
+        self.active  = {}
+        self.ids     = itertools.count()
+        self.lock    = threading.Lock()
+        self.wakeup  = threading.Event()
+        self.sampler = None
+
+    @contextlib.contextmanager
+    def watch(self, plan, context):
+        """
+        Watches the command function run inside of the with block, on the current thread.
+        """
+        run_id = next(self.ids)
+        run = ActiveRun(threading.get_ident(), time.perf_counter(), plan, context)
+        with self.lock:
+            self.active[run_id] = run
+            if self.sampler is None and not self.stopped:
+                self.sampler = threading.Thread(target = self.sample_forever, name = "BOWDN profiler", daemon = True)
+                self.sampler.start()
+        self.wakeup.set()
+        try:
+            yield
+        finally:
+            with self.lock:
+                del self.active[run_id]
+                run.finished = True
+            if run.capture is not None:
+                run.capture.duration = time.perf_counter() - run.start
+                self.save(run.capture)
+
+    def stop(self):
+        """
+        Stops the sampler thread. Commands that are still being watched are no longer sampled.
+        """
+        with self.lock:
+            self.stopped = True
+            sampler = self.sampler
+            self.sampler = None
+        self.wakeup.set()
+        if sampler is not None and sampler is not threading.current_thread():
+            sampler.join()
+
+    def sample_forever(self):
+        while True:
+            self.wakeup.wait()
+            time.sleep(self.sample_interval)
+            with self.lock:
+                if self.stopped:
+                    return
+                if not self.active:
+                    self.wakeup.clear()
+                    continue
+                runs = list(self.active.values())
+            self.sample(runs)
+
+    def sample(self, runs: list):
+        now = time.perf_counter()
+        frames = None
+        for run in runs:
+            if run.skipped or now - run.start < self.threshold:
+                continue
+            if run.capture is None and not self.start_capture(run, now):
+                continue
+            if sum(run.capture.samples.values()) >= self.max_samples:
+                continue
+            if frames is None:
+                frames = sys._current_frames()
+            frame = frames.get(run.thread_id)
+            if frame is not None:
+                run.capture.samples[self.get_stack(frame)] += 1
+
+    def start_capture(self, run: ActiveRun, now: float):
+        """
+        Starts capturing a run that passed the threshold, unless the rate limit does not allow it.
+        """
+        with self.lock:
+            # A run that returned since it was sampled would never save its capture
+            if run.finished:
+                return False
+            if self.last_capture_start is not None and now - self.last_capture_start < self.min_capture_interval:
+                run.skipped = True
+                self.skipped_captures += 1
+                return False
+            self.last_capture_start = now
+            run.capture = SlowCommandCapture(
+                message         = run.context.message_raw[:self.max_message_length] if run.context.message_raw else run.context.message_raw,
+                command_path    = run.plan.get_command_path(),
+                metadata        = self.get_metadata(run.context),
+                started         = time.time() - (now - run.start),
+                sample_interval = self.sample_interval
+            )
+        return True
+
+    def get_metadata(self, context):
+        """
+        Returns the parts of a CommandContext worth keeping with a capture, as strings,
+        so that the capture does not keep the context's objects alive.
+        """
+        return {
+            "flags":       {name: repr(value)[:self.max_message_length] for name, value in context.flags.items()},
+            "token_types": [str(token_type) for token_type in context.token_types],
+            "tokens":      len(context.tokens)
+        }
+
+    def get_stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_stack_depth:
+            code = frame.f_code
+            stack.append(f"{code.co_filename}:{frame.f_lineno} {code.co_name}")
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def save(self, capture: SlowCommandCapture):
+        self.captures.append(capture)
+        if self.directory is None:
+            return
+        # This runs on the command's thread, so a full disk must not replace the command's result
+        try:
+            os.makedirs(self.directory, exist_ok = True)
+            file_name = f"bowdn-slow-{capture.started:.6f}-{os.getpid()}-{threading.get_ident()}.json"
+            with open(os.path.join(self.directory, file_name), "w") as file:
+                json.dump(capture.to_dict(), file)
+            self.remove_old_files()
+        except OSError:
+            self.failed_writes += 1
+
+    def remove_old_files(self):
+        file_names = sorted(
+            file_name for file_name in os.listdir(self.directory)
+            if file_name.startswith("bowdn-slow-") and file_name.endswith(".json")
+        )
+        for file_name in file_names[:max(0, len(file_names) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.directory, file_name))
+            except OSError:
+                pass
@@ -0,0 +1,307 @@
+"""
+A scheduler that sits in front of running commands, for catalogues that serve many callers.
+
+Every command can declare in its meta_data:
+-   "cost": how many rate limit tokens one run of it takes (default 1)
+-   "priority": commands with a higher priority run first when there is a queue (default 0)
+-   "rate_limit": {"rate": tokens per second, "burst": bucket size}, a limit on the command
+    shared by every caller (default: no limit)
+
+Every caller also has its own token bucket, set by caller_rate and caller_burst.
+A command that costs more than the burst of one of its buckets is always rejected, since it could never run.
+Commands whose cost is at least expensive_cost run on their own workers,
+so a queue of expensive commands never delays the cheap ones.
+"""
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from enum import Enum
+from .exceptions import CommandRejectedException
+
+
+class DispatchStatus(str, Enum):
+    QUEUED   = "Queued"
+    DEFERRED = "Deferred"
+    REJECTED = "Rejected"
+    RUNNING  = "Running"
+    DONE     = "Done"
+    FAILED   = "Failed"
+
+    def __repr__(self):
+        return repr(self.value)
+
+    def __str__(self):
+        return self.value
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens and gains rate tokens per second.
+    Tokens may be taken ahead of time, leaving the bucket below zero until it refills.
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate     = rate
+        self.capacity = capacity
+        self.tokens   = capacity
+        self.updated  = time.monotonic()
+
+    def refill(self, now: float):
+        if now > self.updated:
+            self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, cost: float, now: float):
+        """
+        Returns how many seconds it will be until cost tokens can be taken, 0 if they can be taken now,
+        or inf if cost is more than the bucket can ever hold.
+        """
+        if cost > self.capacity:
+            return float("inf")
+        self.refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost: float):
+        self.tokens -= cost
+
+
+class DispatchTicket:
+    """
+    The DispatchTicket class tracks one message submitted to a DispatchScheduler.
+    status is a DispatchStatus. result() waits for the command and returns what it returned,
+    or raises what it raised, or a CommandRejectedException if it was rejected.
+    """
+    __slots__ = ("message", "caller", "command_path", "priority", "status", "retry_after", "future", "args", "kwargs", "default", "plan", "parse_seconds")
+
+    def __init__(self, message: str, caller, default, args: tuple, kwargs: dict):
+        self.message      = message
+        self.caller       = caller
+        self.command_path = None
+        self.priority     = 0
+        self.status       = DispatchStatus.QUEUED
+        # The number of seconds the command was deferred or would have to wait, if it was limited
+        self.retry_after  = None
+        self.future       = Future()
+        self.default      = default
+        self.args         = args
+        self.kwargs       = kwargs
+        # The ParsePlan resolved when the message was submitted, which is what runs
+        self.plan          = None
+        self.parse_seconds = 0.0
+
+    def result(self, timeout: float = None):
+        return self.future.result(timeout)
+
+    def done(self):
+        return self.future.done()
+
+    def __repr__(self):
+        return f"DispatchTicket({self.message!r}, caller={self.caller!r}, status={self.status})"
+
+
+class Lane:
+    """
+    A priority queue of tickets with its own worker threads.
+    ready holds (-priority, order, ticket), and deferred holds (time it may run, order, ticket).
+    """
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name      = name
+        self.workers   = workers
+        self.max_queue = max_queue
+        self.ready     = []
+        self.deferred  = []
+        self.condition = threading.Condition()
+        self.threads   = []
+
+    def __len__(self):
+        return len(self.ready) + len(self.deferred)
+
+
+class DispatchScheduler:
+    """
+    Rate limits and prioritizes the commands of a CommandCatalogue, see the module docstring.
+    -   caller_rate and caller_burst set the token bucket of every caller.
+    -   on_limit is what happens to a call over its rate limit: "reject" it, or "defer" it until
+        the tokens for it are available, if that is at most max_defer seconds away.
+    -   cheap_workers and expensive_workers are the number of threads that run commands with a cost
+        below and at least expensive_cost.
+    -   max_queue is the most calls that may wait in each lane before new ones are rejected.
+    -   max_callers is how many callers' buckets are kept. Past it, the bucket of the caller
+        that was seen least recently is dropped, which has most likely refilled by then.
+    """
+    def __init__(self, catalogue,
+        caller_rate: float     = 5.0,
+        caller_burst: float    = 10.0,
+        on_limit: str          = "reject",
+        max_defer: float       = 5.0,
+        cheap_workers: int     = 4,
+        expensive_workers: int = 1,
+        expensive_cost: float  = 10.0,
+        max_queue: int         = 1000,
+        max_callers: int       = 10000
+    ):
+        if on_limit not in ("reject", "defer"):
+            raise ValueError(f"Unknown on_limit '{on_limit}'. Expected 'reject' or 'defer'.")
+        self.catalogue       = catalogue
+        self.caller_rate     = caller_rate
+        self.caller_burst    = caller_burst
+        self.on_limit        = on_limit
+        self.max_defer       = max_defer
+        self.expensive_cost  = expensive_cost
+        self.max_callers     = max_callers
+        # In the order the callers were last seen, the least recent first
+        self.caller_buckets  = OrderedDict()
+        self.command_buckets = {}
+        self.lock            = threading.Lock()
+        self.order           = itertools.count()
+        self.stopping        = False
+        self.cheap_lane      = Lane("cheap", cheap_workers, max_queue)
+        self.expensive_lane  = Lane("expensive", expensive_workers, max_queue)
+        for lane in (self.cheap_lane, self.expensive_lane):
+            for i in range(lane.workers):
+                thread = threading.Thread(target = self.work, args = (lane,), name = f"BOWDN {lane.name} worker {i}", daemon = True)
+                lane.threads.append(thread)
+                thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def submit(self, message: str, caller = None, default = None, *args, on_limit: str = None, **kwargs):
+        """
+        Parses a message and queues its command to run, unless it is over a rate limit.
+        Returns a DispatchTicket right away, whose status says if the command was queued,
+        deferred or rejected. Messages that are not commands are done right away with default.
+        on_limit overrides the scheduler's on_limit for this call.
+        *args and **kwargs are passed through to the command's function, like in parse.
+        """
+        ticket = DispatchTicket(message, caller, default, args, kwargs)
+        start = time.perf_counter()
+        try:
+            plan = self.catalogue.get_parse_plan(message)
+        except Exception as e:
+            return self.finish(ticket, DispatchStatus.FAILED, exception = e)
+        if plan is None:
+            return self.finish(ticket, DispatchStatus.DONE, result = default)
+        ticket.parse_seconds = time.perf_counter() - start
+
+        ticket.plan = plan
+        ticket.command_path = plan.get_command_path()
+        meta_data = plan.command.meta_data
+        cost      = meta_data.get("cost", 1)
+        ticket.priority = meta_data.get("priority", 0)
+        lane      = self.expensive_lane if cost >= self.expensive_cost else self.cheap_lane
+        on_limit  = on_limit or self.on_limit
+        rate_limit = meta_data.get("rate_limit")
+        if rate_limit and not (isinstance(rate_limit, dict) and rate_limit.get("rate", 0) > 0):
+            return self.finish(ticket, DispatchStatus.FAILED, exception = ValueError(
+                f"The rate_limit of '{ticket.command_path}' must be a dict with a \"rate\" above 0, not {rate_limit!r}."
+            ))
+
+        with self.lock:
+            now = time.monotonic()
+            buckets = [self.get_caller_bucket(caller)]
+            if rate_limit:
+                buckets.append(self.get_command_bucket(ticket.command_path, rate_limit))
+            wait = max(bucket.wait_time(cost, now) for bucket in buckets)
+
+            if wait == float("inf"):
+                return self.finish(ticket, DispatchStatus.REJECTED, exception = CommandRejectedException(
+                    f"'{ticket.command_path}' costs {cost}, which is more than its rate limit allows at once.",
+                    reason = "cost_exceeds_burst"
+                ))
+            if wait > 0 and (on_limit == "reject" or wait > self.max_defer):
+                ticket.retry_after = wait
+                return self.finish(ticket, DispatchStatus.REJECTED, exception = CommandRejectedException(
+                    f"'{ticket.command_path}' is over its rate limit, retry after {wait:.3f} seconds.",
+                    reason = "rate_limited",
+                    retry_after = wait
+                ))
+            with lane.condition:
+                if self.stopping or len(lane) >= lane.max_queue:
+                    return self.finish(ticket, DispatchStatus.REJECTED, exception = CommandRejectedException(
+                        f"The {lane.name} command queue is full.",
+                        reason = "queue_full"
+                    ))
+                # The tokens are taken now, even for a deferred call, so that later calls queue up behind it
+                for bucket in buckets:
+                    bucket.take(cost)
+                if wait > 0:
+                    ticket.status = DispatchStatus.DEFERRED
+                    ticket.retry_after = wait
+                    heapq.heappush(lane.deferred, (now + wait, next(self.order), ticket))
+                else:
+                    heapq.heappush(lane.ready, (-ticket.priority, next(self.order), ticket))
+                lane.condition.notify()
+        return ticket
+
+    def get_caller_bucket(self, caller):
+        bucket = self.caller_buckets.get(caller)
+        if bucket is not None:
+            self.caller_buckets.move_to_end(caller)
+            return bucket
+        while len(self.caller_buckets) >= self.max_callers:
+            self.caller_buckets.popitem(last = False)
+        bucket = self.caller_buckets[caller] = TokenBucket(self.caller_rate, self.caller_burst)
+        return bucket
+
+    def get_command_bucket(self, command_path: str, rate_limit: dict):
+        bucket = self.command_buckets.get(command_path)
+        if bucket is None:
+            bucket = self.command_buckets[command_path] = TokenBucket(rate_limit["rate"], rate_limit.get("burst", rate_limit["rate"]))
+        return bucket
+
+    def finish(self, ticket: DispatchTicket, status: DispatchStatus, result = None, exception = None):
+        ticket.status = status
+        if exception is not None:
+            ticket.future.set_exception(exception)
+        else:
+            ticket.future.set_result(result)
+        return ticket
+
+    def work(self, lane: Lane):
+        while True:
+            with lane.condition:
+                while True:
+                    now = time.monotonic()
+                    while lane.deferred and lane.deferred[0][0] <= now:
+                        _, order, ticket = heapq.heappop(lane.deferred)
+                        heapq.heappush(lane.ready, (-ticket.priority, order, ticket))
+                    if lane.ready:
+                        _, _, ticket = heapq.heappop(lane.ready)
+                        break
+                    if self.stopping and not lane.deferred:
+                        return
+                    lane.condition.wait(lane.deferred[0][0] - now if lane.deferred else None)
+            self.run(ticket)
+
+    def run(self, ticket: DispatchTicket):
+        ticket.status = DispatchStatus.RUNNING
+        try:
+            # The plan that was charged for is what runs, even if the catalogue changed since
+            result = self.catalogue.run_plan(ticket.plan, ticket.message, ticket.args, ticket.kwargs, ticket.parse_seconds)
+        except Exception as e:
+            self.finish(ticket, DispatchStatus.FAILED, exception = e)
+        else:
+            self.finish(ticket, DispatchStatus.DONE, result = result)
+
+    def shutdown(self, wait: bool = True):
+        """
+        Stops accepting new calls. The worker threads finish every queued and deferred call first.
+        """
+        self.stopping = True
+        for lane in (self.cheap_lane, self.expensive_lane):
+            with lane.condition:
+                lane.condition.notify_all()
+        if wait:
+            for lane in (self.cheap_lane, self.expensive_lane):
+                for thread in lane.threads:
+                    thread.join()
@@ -0,0 +1,266 @@
+"""
+Serves a CommandCatalogue over a TCP or Unix domain socket, so that many local clients
+can share one process with a warm catalogue instead of each building their own.
+
+Every request is one message, and every response is a JSON object:
+-   {"ok": true, "result": <what the command returned>}
+-   {"ok": false, "error": <exception class name>, "message": <exception message>},
+    with "suggestions" added for a CommandNotRecognizedException.
+Results that are not JSON serializable are sent as their str.
+
+Requests and responses are framed in one of two ways:
+-   "line": UTF-8 text ending in a newline. Messages cannot contain newlines,
+    which is never a problem for responses since JSON escapes them.
+-   "length": a 4 byte big-endian length followed by that many bytes of UTF-8.
+
+A client may send many requests without waiting for their responses (pipelining).
+They are run concurrently, and their responses are always sent in the order of the requests.
+"""
+import asyncio
+import json
+import struct
+from .exceptions import CommandNotRecognizedException, FrameTooLargeException
+
+
+FRAMINGS = ("line", "length")
+
+LENGTH_PREFIX = struct.Struct(">I")
+
+DEFAULT_MAX_MESSAGE_SIZE = 65536
+
+
+def encode_frame(data: bytes, framing: str = "line"):
+    """
+    Frames one request or response to be written to a socket.
+    """
+    if framing == "line":
+        return data + b"\n"
+    return LENGTH_PREFIX.pack(len(data)) + data
+
+
+async def read_frame(reader: asyncio.StreamReader, framing: str = "line", max_size: int = DEFAULT_MAX_MESSAGE_SIZE):
+    """
+    Reads one framed request or response, without its framing.
+    Returns None once the other side has closed the connection.
+    Raises a FrameTooLargeException if it is longer than max_size bytes. The rest of the
+    connection cannot be read after that, since the end of the frame is not known.
+    """
+    if framing == "line":
+        try:
+            line = await reader.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            # The last line of a connection does not need a newline
+            if not e.partial:
+                return None
+            line = e.partial
+        except asyncio.LimitOverrunError:
+            raise FrameTooLargeException(f"The message is longer than {max_size} bytes.")
+        if line.endswith(b"\n"):
+            line = line[:-1]
+        if line.endswith(b"\r"):
+            line = line[:-1]
+        if len(line) > max_size:
+            raise FrameTooLargeException(f"The message is longer than {max_size} bytes.")
+        return line
+
+    try:
+        header = await reader.readexactly(LENGTH_PREFIX.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionError("The connection was closed in the middle of a length prefix.") from e
+    size = LENGTH_PREFIX.unpack(header)[0]
+    if size > max_size:
+        raise FrameTooLargeException(f"The message is {size} bytes, which is longer than {max_size} bytes.")
+    try:
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError("The connection was closed in the middle of a message.") from e
+
+
+class CommandServer:
+    """
+    Serves a CommandCatalogue over sockets, see the module docstring and CommandCatalogue.create_server.
+    Every message is run with catalogue.parse_async, so the catalogue's max_concurrency,
+    executor, caches and instrumentation all apply.
+    -   framing is "line" or "length".
+    -   default is what parse_async returns for messages that are not commands.
+    -   max_connections is how many clients may be connected at once. Clients over it
+        get a "TooManyConnections" error response and are disconnected.
+    -   max_pending is how many requests of one connection may be running or waiting to be sent
+        at once. Past it, the server stops reading from the connection until a response is sent,
+        so a client that sends faster than it reads is slowed down by the socket instead of
+        filling the server's memory.
+    -   max_message_size is the longest request in bytes. A longer one gets a "FrameTooLarge"
+        error response and the connection is closed.
+    """
+    def __init__(self, catalogue,
+        framing: str          = "line",
+        default               = None,
+        max_connections: int  = 100,
+        max_pending: int      = 32,
+        max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE
+    ):
+        if framing not in FRAMINGS:
+            raise ValueError(f"Unknown framing '{framing}'. Expected one of: {', '.join(FRAMINGS)}.")
+        self.catalogue        = catalogue
+        self.framing          = framing
+        self.default          = default
+        self.max_connections  = max_connections
+        self.max_pending      = max_pending
+        self.max_message_size = max_message_size
+        self.server           = None
+        self.writers          = set()
+        self.rejected_connections = 0
+        self.requests             = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start_tcp(self, host: str = "127.0.0.1", port: int = 0):
+        """
+        Starts listening on a TCP port, and returns the asyncio.Server.
+        Port 0 picks a free port, which get_address returns.
+        """
+        self.server = await asyncio.start_server(self.handle_connection, host, port, limit = self.get_stream_limit())
+        return self.server
+
+    async def start_unix(self, path: str):
+        """
+        Starts listening on a Unix domain socket at path, and returns the asyncio.Server.
+        """
+        self.server = await asyncio.start_unix_server(self.handle_connection, path, limit = self.get_stream_limit())
+        return self.server
+
+    async def serve_forever(self):
+        """
+        Serves clients until the task running it is cancelled or close is called.
+        start_tcp or start_unix must be called first.
+        """
+        try:
+            await self.server.serve_forever()
+        except asyncio.CancelledError:
+            await self.close()
+            raise
+
+    async def close(self):
+        """
+        Stops listening and disconnects every client.
+        """
+        if self.server is not None:
+            self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        if self.server is not None:
+            await self.server.wait_closed()
+
+    def get_address(self):
+        """
+        Returns the address the server is listening on, ie. ("127.0.0.1", port) for TCP.
+        """
+        return self.server.sockets[0].getsockname()
+
+    @property
+    def connections(self):
+        return len(self.writers)
+
+    def get_stream_limit(self):
+        # A line may only be this long before its newline is found, see read_frame
+        return max(self.max_message_size + 2, 2 ** 16)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        if len(self.writers) >= self.max_connections:
+            self.rejected_connections += 1
+            try:
+                writer.write(self.encode_response({
+                    "ok": False,
+                    "error": "TooManyConnections",
+                    "message": f"The server already has {self.max_connections} connections."
+                }))
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+            return
+
+        self.writers.add(writer)
+        # Holds the task of every request in the order they were read, then None once reading stops
+        pending = asyncio.Queue()
+        # Released by write_responses every time a response is sent
+        slots   = asyncio.Semaphore(self.max_pending)
+        writing = asyncio.create_task(self.write_responses(pending, writer, slots))
+        try:
+            while True:
+                # Waits here while max_pending requests are unanswered, which is the backpressure
+                await slots.acquire()
+                try:
+                    message = await read_frame(reader, self.framing, self.max_message_size)
+                except FrameTooLargeException as e:
+                    pending.put_nowait(self.get_completed_task(self.get_error_response(e, "FrameTooLarge")))
+                    break
+                except ConnectionError:
+                    break
+                if message is None:
+                    break
+                self.requests += 1
+                pending.put_nowait(asyncio.create_task(self.dispatch(message)))
+        finally:
+            pending.put_nowait(None)
+            await writing
+            self.writers.discard(writer)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def dispatch(self, message: bytes):
+        """
+        Runs one request through the catalogue and returns its response.
+        """
+        try:
+            result = await self.catalogue.parse_async(message.decode("utf-8"), self.default)
+        except Exception as e:
+            return self.get_error_response(e)
+        return {"ok": True, "result": result}
+
+    async def write_responses(self, pending: asyncio.Queue, writer: asyncio.StreamWriter, slots: asyncio.Semaphore):
+        """
+        Sends the response of every request in pending, in order, until it gets None,
+        releasing a slot for another request after each one.
+        """
+        disconnected = False
+        while True:
+            task = await pending.get()
+            if task is None:
+                return
+            response = await task
+            # The remaining requests are still awaited so that none of them are left running unobserved
+            if not disconnected:
+                try:
+                    writer.write(self.encode_response(response))
+                    await writer.drain()
+                except ConnectionError:
+                    disconnected = True
+            slots.release()
+
+    def get_completed_task(self, response: dict):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(response)
+        return future
+
+    def get_error_response(self, exception: Exception, error: str = None):
+        response = {
+            "ok": False,
+            "error": error or type(exception).__name__,
+            "message": str(exception)
+        }
+        if isinstance(exception, CommandNotRecognizedException):
+            response["suggestions"] = exception.suggestions
+        return response
+
+    def encode_response(self, response: dict):
+        return encode_frame(json.dumps(response, default = str).encode("utf-8"), self.framing)
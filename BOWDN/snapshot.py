@@ -0,0 +1,117 @@
+"""
+Snapshots store a fully built CommandCatalogue, with all of its lookup tables, in a file
+that loads much faster than building the catalogue from its commands dict again.
+
+Functions (command functions, custom tokenizers) are stored by their import path
+(ie. my_bot.commands.status) and imported again when the snapshot is loaded,
+so they must be defined at the top level of an importable module.
+Snapshots are pickle files and must only be loaded from trusted sources.
+"""
+import copyreg
+import gc
+import hashlib
+import io
+import pickle
+from types import MappingProxyType
+from .command import EMPTY_MAPPING
+from .exceptions import SnapshotException, SnapshotOutdatedException
+
+
+# Changes whenever the layout of a snapshot changes, so that old snapshots are not loaded
+SNAPSHOT_VERSION = 2
+
+# A fixed pickle protocol, so that hashes do not change with the Python version
+HASH_PROTOCOL = 4
+
+
+def get_empty_mapping():
+    return EMPTY_MAPPING
+
+def make_mapping_proxy(mapping: dict):
+    return MappingProxyType(mapping)
+
+def reduce_mapping_proxy(mapping_proxy):
+    """
+    Pickles the shared EMPTY_MAPPING so that it is still shared once it is loaded,
+    and any other read-only mapping as a copy of its contents.
+    """
+    if mapping_proxy is EMPTY_MAPPING:
+        return (get_empty_mapping, ())
+    return (make_mapping_proxy, (dict(mapping_proxy),))
+
+
+# Functions are pickled by their import path by pickle itself, only read-only mappings need help
+DISPATCH_TABLE = copyreg.dispatch_table.copy()
+DISPATCH_TABLE[MappingProxyType] = reduce_mapping_proxy
+
+
+def dump(value, protocol: int, fast: bool = False):
+    """
+    Pickles a value to bytes.
+    Raises a SnapshotException if it holds a function that cannot be imported by its path,
+    ie. a lambda or a function defined inside of another function.
+    If fast is True, nothing is memoized, so equal values always give the same bytes
+    no matter which of their objects are shared.
+    """
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol)
+    pickler.dispatch_table = DISPATCH_TABLE
+    pickler.fast = fast
+    try:
+        pickler.dump(value)
+    except (pickle.PicklingError, AttributeError, TypeError) as e:
+        raise SnapshotException(f"The catalogue cannot be stored in a snapshot: {e}") from e
+    return buffer.getvalue()
+
+
+def hash_commands_dict(commands_dict: dict, settings: dict = None):
+    """
+    Returns a hash of a commands dict (and the settings of its catalogue)
+    that changes whenever anything in them changes.
+    """
+    return hashlib.sha256(dump((SNAPSHOT_VERSION, commands_dict, settings), HASH_PROTOCOL, fast = True)).hexdigest()
+
+
+def save_snapshot(catalogue, path: str):
+    """
+    Writes a snapshot of a catalogue to a file.
+    Sub commands of a lazy catalogue are built first, since their loaders cannot be stored.
+    """
+    for command in catalogue.commands.values():
+        command.load_all_sub_commands()
+    snapshot = {
+        "version":       SNAPSHOT_VERSION,
+        "hash":          hash_commands_dict(catalogue.commands_dict, catalogue.settings),
+        "settings":      catalogue.settings,
+        "commands":      catalogue.commands,
+        "command_index": catalogue.command_index
+    }
+    data = dump(snapshot, pickle.HIGHEST_PROTOCOL)
+    with open(path, "wb") as file:
+        file.write(data)
+
+
+def load_snapshot(path: str, commands_dict: dict = None):
+    """
+    Reads a snapshot from a file and returns it as a dict.
+    If commands_dict is given, raises a SnapshotOutdatedException if the snapshot
+    was not built from it (with the same settings).
+    """
+    # Unpickling creates a lot of objects but no garbage, so the garbage collector
+    # is paused instead of running over the new objects again and again
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, "rb") as file:
+            snapshot = pickle.load(file)
+    except (ImportError, AttributeError) as e:
+        raise SnapshotException(f"A function in the snapshot {path} could not be imported: {e}") from e
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    if not isinstance(snapshot, dict) or snapshot.get("version") != SNAPSHOT_VERSION:
+        raise SnapshotOutdatedException(f"The snapshot {path} was made by a different version of BOWDN.")
+    if commands_dict is not None and hash_commands_dict(commands_dict, snapshot["settings"]) != snapshot["hash"]:
+        raise SnapshotOutdatedException(f"The snapshot {path} does not match the commands dict it is loaded for.")
+    return snapshot
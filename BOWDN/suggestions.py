@@ -0,0 +1,143 @@
+"""
+Indexes the names and aliases of one level of commands (the top level commands of a
+CommandCatalogue, or the sub commands of a Command) for prefix completion
+and "did you mean" suggestions.
+"""
+import bisect
+
+
+def edit_distance(a: str, b: str):
+    """
+    Returns the Levenshtein distance between two strings.
+    """
+    return pattern_distance(make_pattern(b), a)
+
+
+def make_pattern(word: str):
+    """
+    Precomputes the bit vectors that pattern_distance needs for a word,
+    so that comparing the same word to many others only does it once.
+    Each bit of a bit vector stands for one character of the word.
+    """
+    match_masks = {}
+    for i, char in enumerate(word):
+        match_masks[char] = match_masks.get(char, 0) | (1 << i)
+    return (word, len(word), match_masks)
+
+
+def pattern_distance(pattern: tuple, text: str):
+    """
+    Returns the Levenshtein distance between a word made into a pattern by make_pattern and text,
+    using the bit-parallel algorithm of Myers (1999) so that each character of text
+    costs a few integer operations.
+    """
+    word, length, match_masks = pattern
+    if word == text:
+        return 0
+    if not length:
+        return len(text)
+
+    mask = (1 << length) - 1
+    last_bit = 1 << (length - 1)
+    positive = mask
+    negative = 0
+    distance = length
+    for char in text:
+        match = match_masks.get(char, 0)
+        vertical = match | negative
+        horizontal = (((match & positive) + positive) ^ positive) | match
+        horizontal_positive = negative | ~(horizontal | positive)
+        horizontal_negative = positive & horizontal
+        if horizontal_positive & last_bit:
+            distance += 1
+        elif horizontal_negative & last_bit:
+            distance -= 1
+        horizontal_positive = (horizontal_positive << 1) | 1
+        horizontal_negative = horizontal_negative << 1
+        positive = (horizontal_negative | ~(vertical | horizontal_positive)) & mask
+        negative = horizontal_positive & vertical & mask
+    return distance
+
+
+class BKTree:
+    """
+    A Burkhard-Keller tree of words, which finds every word within an edit distance
+    of a query while only comparing the query to a small part of the words.
+    Each node is a list of [word, {distance to the node's word: child node}].
+    """
+    def __init__(self, words = ()):
+        self.root = None
+        for word in words:
+            self.add(word)
+
+    def add(self, word: str):
+        if self.root is None:
+            self.root = [word, {}]
+            return
+        pattern = make_pattern(word)
+        node = self.root
+        while True:
+            distance = pattern_distance(pattern, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [word, {}]
+                return
+            node = child
+
+    def search(self, word: str, max_distance: int):
+        """
+        Returns a list of (distance, word) for every word within max_distance of word.
+        """
+        if self.root is None:
+            return []
+        pattern = make_pattern(word)
+        matches = []
+        nodes = [self.root]
+        while nodes:
+            node_word, children = nodes.pop()
+            distance = pattern_distance(pattern, node_word)
+            if distance <= max_distance:
+                matches.append((distance, node_word))
+            # By the triangle inequality, only children this far from node_word can match
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return matches
+
+
+class SuggestionIndex:
+    """
+    The SuggestionIndex class holds the names and aliases of one level of commands
+    in a sorted list for prefix completion and in a BKTree for close matches.
+    """
+    __slots__ = ("words", "bk_tree")
+
+    def __init__(self, words):
+        self.words   = sorted(set(words))
+        self.bk_tree = BKTree(self.words)
+
+    def get_completions(self, prefix: str, limit: int = 10):
+        """
+        Returns up to limit names and aliases that start with prefix, in alphabetical order.
+        """
+        completions = []
+        for index in range(bisect.bisect_left(self.words, prefix), len(self.words)):
+            word = self.words[index]
+            if not word.startswith(prefix) or len(completions) >= limit:
+                break
+            completions.append(word)
+        return completions
+
+    def get_suggestions(self, token: str, max_distance: int = 2, limit: int = 5):
+        """
+        Returns up to limit names and aliases within max_distance edits of token,
+        closest first. Names and aliases that start with token rank as if they were one edit away.
+        """
+        ranked = {}
+        for distance, word in self.bk_tree.search(token, max_distance):
+            ranked[word] = distance
+        for word in self.get_completions(token, limit):
+            ranked[word] = min(ranked.get(word, 1), 1)
+        return sorted(ranked, key = lambda word: (ranked[word], word))[:limit]
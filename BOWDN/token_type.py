@@ -0,0 +1,18 @@
+from enum import Enum
+
+
+class TokenType(str, Enum):
+    """
+    The types of token a message is classified into.
+    TokenType is a str, so each member is equal to its plain string value (ie. TokenType.COMMAND == "Command").
+    """
+    COMMAND     = "Command"
+    SUB_COMMAND = "Sub Command"
+    FLAG        = "Flag"
+    ARGUMENT    = "Argument"
+
+    def __repr__(self):
+        return repr(self.value)
+
+    def __str__(self):
+        return self.value
@@ -0,0 +1,154 @@
+"""
+Tokenizers turn a message into a list of tokens delimited by whitespace,
+accounting for quoted substrings.
+
+Both tokenizers follow the quoting rules of shlex.split (posix mode, no comments):
+-   Single quotes keep everything up to the next single quote literally.
+-   Double quotes keep everything up to the next unescaped double quote,
+    where a backslash only escapes a double quote or another backslash.
+-   Outside of quotes a backslash escapes any character.
+-   Quoted and unquoted parts that touch are joined into one token,
+    so -am="quoted value" becomes the single token -am=quoted value.
+"""
+import re
+import shlex
+
+
+WHITESPACE   = " \t\r\n"
+SPECIAL_CHARS = ("'", '"', "\\")
+
+# Matches a whole token: a run of unquoted characters, quoted substrings and escaped characters
+TOKEN_PATTERN = re.compile(r"""(?:[^ \t\r\n'"\\]+|'[^']*'|"(?:[^"\\]|\\[\s\S])*"|\\[\s\S])+""")
+
+# Matches one part of a token, with a group for each kind of part
+PART_PATTERN = re.compile(r"""([^ \t\r\n'"\\]+)|'([^']*)'|"((?:[^"\\]|\\[\s\S])*)"|\\([\s\S])""")
+
+# Matches a token that contains no quotes or backslashes
+PLAIN_TOKEN_PATTERN = re.compile(r"[^ \t\r\n]+")
+
+# Matches the whitespace at the start of a message, the same way str.strip does
+LEADING_WHITESPACE_PATTERN = re.compile(r"\s*")
+
+# Matches an escaped character inside of double quotes
+DOUBLE_QUOTE_ESCAPE_PATTERN = re.compile(r'\\(["\\])')
+
+
+def shlex_tokenize(string: str):
+    """
+    Tokenizes a string with shlex.split.
+    """
+    return shlex.split(string)
+
+
+def fast_tokenize(string: str, start: int = 0, end: int = None):
+    """
+    Tokenizes a string in a single regex driven pass.
+    Gives the same tokens as shlex.split and raises the same ValueErrors
+    for unclosed quotes and trailing backslashes.
+    If start and end are given, only string[start:end] is tokenized, without copying it.
+    """
+    if end is None:
+        end = len(string)
+    if not any(char in string for char in SPECIAL_CHARS):
+        return PLAIN_TOKEN_PATTERN.findall(string, start, end)
+
+    tokens = []
+    position = start
+    for match in TOKEN_PATTERN.finditer(string, start, end):
+        check_gap(string, position, match.start(), end)
+        position = match.end()
+        token = match.group()
+        if not any(char in token for char in SPECIAL_CHARS):
+            tokens.append(token)
+        else:
+            tokens.append(unquote_token(token))
+    check_gap(string, position, end, end)
+    return tokens
+
+
+def strip_span(string: str, start: int = 0):
+    """
+    Returns the (start, end) span of string[start:].strip() without copying the string.
+    """
+    start = LEADING_WHITESPACE_PATTERN.match(string, start).end()
+    end = len(string)
+    while end > start and string[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def unquote_token(token: str):
+    """
+    Removes the quotes and escape characters from a token matched by TOKEN_PATTERN.
+    """
+    parts = []
+    for plain, single_quoted, double_quoted, escaped in PART_PATTERN.findall(token):
+        if plain:
+            parts.append(plain)
+        elif escaped:
+            parts.append(escaped)
+        elif double_quoted:
+            parts.append(DOUBLE_QUOTE_ESCAPE_PATTERN.sub(r"\1", double_quoted))
+        else:
+            parts.append(single_quoted)
+    return "".join(parts)
+
+
+def check_gap(string: str, start: int, end: int, string_end: int):
+    """
+    Checks that the characters between two tokens are only whitespace.
+    Anything else is a quote or backslash that could not be matched.
+    string_end is where the tokenized part of the string ends.
+    """
+    for index in range(start, end):
+        char = string[index]
+        if char in WHITESPACE:
+            continue
+        if char == "\\" or (char == '"' and ends_in_escape(string, index + 1, string_end)):
+            raise ValueError("No escaped character")
+        raise ValueError("No closing quotation")
+
+
+def ends_in_escape(string: str, start: int, end: int):
+    """
+    Checks if an unclosed double quoted substring from start to end
+    ends with a backslash that has nothing left to escape.
+    """
+    index = string.find("\\", start, end)
+    while index != -1:
+        if index == end - 1:
+            return True
+        index = string.find("\\", index + 2, end)
+    return False
+
+
+def get_first_token(string: str, start: int = 0):
+    """
+    Returns the first token of a string, starting from start, without tokenizing the rest of it.
+    Returns None if the first token contains quotes or backslashes and needs a full tokenizer.
+    """
+    start = LEADING_WHITESPACE_PATTERN.match(string, start).end()
+    token = PLAIN_TOKEN_PATTERN.match(string, start)
+    if token is None:
+        return ""
+    token = token.group()
+    if any(char in token for char in SPECIAL_CHARS):
+        return None
+    return token.rstrip()
+
+
+TOKENIZERS = {
+    "shlex": shlex_tokenize,
+    "fast":  fast_tokenize
+}
+
+
+def get_tokenizer(tokenizer):
+    """
+    Returns the tokenizer function for a tokenizer name, or the tokenizer itself if it is callable.
+    """
+    if callable(tokenizer):
+        return tokenizer
+    if tokenizer not in TOKENIZERS:
+        raise ValueError(f"Unknown tokenizer '{tokenizer}'. Expected one of {list(TOKENIZERS)} or a callable.")
+    return TOKENIZERS[tokenizer]
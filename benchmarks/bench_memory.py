@@ -0,0 +1,77 @@
+"""
+Measures how much memory a CommandCatalogue uses per command,
+and how many memory blocks and bytes every parse leaves behind in its CommandContext.
+
+Run from the root of the repository:
+    python benchmarks/bench_memory.py
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from BOWDN import CommandCatalogue
+
+
+COMMAND_COUNT = 5000
+PARSE_COUNT   = 5000
+
+
+def return_context(*arguments, context = None):
+    return context
+
+
+def make_commands_dict(command_count: int):
+    commands_dict = {}
+    for i in range(command_count):
+        commands_dict[f"command_{i}"] = {
+            "aliases": [f"alias_{i}_a", f"alias_{i}_b"],
+            "description": f"Description of command {i}.",
+            "function": return_context,
+            "flags": {
+                "help": {"short_name": "h", "default_value_present": True, "default_value_absent": False},
+                "verbose": {"short_name": "v", "long_aliases": ["loud"], "default_value_present": True, "default_value_absent": False},
+                "format": {"short_name": "f", "accepts_input": True, "default_value_present": "text", "default_value_absent": "text"}
+            }
+        }
+    return commands_dict
+
+
+def measure_catalogue(commands_dict: dict):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    catalogue = CommandCatalogue(commands_dict)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return catalogue, size / len(commands_dict)
+
+
+def measure_parse(catalogue, messages: list):
+    contexts = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for message in messages:
+        contexts.append(catalogue.parse(message))
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    size   = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    # The list that holds the contexts is not part of a parse
+    size -= sys.getsizeof(contexts)
+    return size / len(messages), blocks / len(messages)
+
+
+def main():
+    commands_dict = make_commands_dict(COMMAND_COUNT)
+    catalogue, bytes_per_command = measure_catalogue(commands_dict)
+    messages = [f"command_{i % COMMAND_COUNT} -h --format=json argument_1 argument_2" for i in range(PARSE_COUNT)]
+    bytes_per_parse, blocks_per_parse = measure_parse(catalogue, messages)
+    print(f"Bytes per command:       {bytes_per_command:.0f}")
+    print(f"Bytes kept per parse:    {bytes_per_parse:.0f}")
+    print(f"Allocations kept per parse: {blocks_per_parse:.1f}")
+
+
+if __name__ == "__main__":
+    main()
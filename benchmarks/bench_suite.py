@@ -0,0 +1,304 @@
+"""
+Benchmarks building and parsing with synthetic catalogues and message corpora (see corpus.py),
+and compares the results to a stored baseline to catch regressions.
+
+For every scenario it measures:
+-   build_seconds: the time to build the CommandCatalogue
+-   bytes_per_command: the memory the built catalogue uses per command, top level or not
+-   messages_per_second: parse throughput over the whole corpus
+-   p50_us, p90_us, p99_us: the latency percentiles of a single parse, in microseconds,
+    each the median over the repeats
+-   peak_bytes_per_parse: the most memory a typical parse had allocated at once, which is
+    the median over the messages, since a few parses also pay for the interpreter growing its memory pools
+
+Run from the root of the repository:
+    python benchmarks/bench_suite.py                      compare to benchmarks/baseline.json
+    python benchmarks/bench_suite.py --save               replace benchmarks/baseline.json
+    python benchmarks/bench_suite.py --quick --scenario flat
+
+Timings depend on the machine, so save a baseline on the same machine before
+making a change, and compare to it afterwards. Memory measurements are stable across machines.
+Each metric has its own tolerance (see TOLERANCES), since tail latencies and build times
+vary much more between runs of the same code than throughput does.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from BOWDN import CommandCatalogue
+from BOWDN.exceptions import CommandNotRecognizedException
+from bench_memory import measure_catalogue
+from corpus import make_commands_dict, make_messages
+
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# Each scenario is (arguments of make_commands_dict, arguments of make_messages),
+# optionally followed by the settings of its CommandCatalogue, which default to DEFAULT_SETTINGS
+SCENARIOS = {
+    "flat": (
+        {"command_count": 5000, "alias_count": 2, "flag_count": 3},
+        {"count": 20000}
+    ),
+    "nested": (
+        {"command_count": 200, "depth": 3, "sub_command_count": 4, "alias_count": 1, "flag_count": 3},
+        {"count": 20000}
+    ),
+    "flag_heavy": (
+        {"command_count": 1000, "alias_count": 2, "flag_count": 24},
+        {"count": 10000, "flag_ratio": 0.5}
+    ),
+    "misses": (
+        {"command_count": 5000, "alias_count": 2, "flag_count": 3},
+        {"count": 20000, "hit_ratio": 0.1},
+        # Unknown commands raise, and their suggestions are read like CommandServer does
+        {"ignore_unknown_commands": False}
+    ),
+    "long_arguments": (
+        {"command_count": 100, "flag_count": 3},
+        {"count": 1000, "long_argument_ratio": 1.0, "long_argument_count": 300}
+    ),
+    "quoted": (
+        {"command_count": 1000, "flag_count": 3},
+        {"count": 10000, "argument_count": (2, 8), "quoted_ratio": 0.8}
+    )
+}
+
+DEFAULT_SETTINGS = {"ignore_unknown_commands": True}
+
+# The metrics that are better when higher, all others are better when lower
+HIGHER_IS_BETTER = {"messages_per_second"}
+
+# How much worse than the baseline each metric may get before it is a regression
+TOLERANCES = {
+    "build_seconds": 0.5,
+    "bytes_per_command": 0.05,
+    "messages_per_second": 0.25,
+    "p50_us": 0.25,
+    "p90_us": 0.5,
+    "p99_us": 1.0,
+    "peak_bytes_per_parse": 0.1
+}
+DEFAULT_TOLERANCE = 0.25
+
+QUICK_SCALE = 0.1
+
+
+def scale_scenario(catalogue_arguments: dict, corpus_arguments: dict, scale: float, *_):
+    catalogue_arguments = dict(catalogue_arguments)
+    corpus_arguments = dict(corpus_arguments)
+    catalogue_arguments["command_count"] = max(1, int(catalogue_arguments["command_count"] * scale))
+    corpus_arguments["count"] = max(1, int(corpus_arguments["count"] * scale))
+    return catalogue_arguments, corpus_arguments
+
+
+def count_commands(commands_dict: dict):
+    return sum(1 + count_commands(command.get("sub_commands", {})) for command in commands_dict.values())
+
+
+def timed(function):
+    """
+    Runs function with the garbage collector paused, like timeit does,
+    so that when a collection happens to run does not change the timings.
+    """
+    def run(*args, **kwargs):
+        gc.collect()
+        gc.disable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            gc.enable()
+    return run
+
+
+def percentile(sorted_values: list, fraction: float):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def get_parse(catalogue):
+    """
+    Returns the function the measurements call for every message. When unknown commands raise,
+    it catches the CommandNotRecognizedException and reads its suggestions, which CommandServer
+    sends with every such error, so that the whole cost of a miss is measured.
+    """
+    if catalogue.ignore_unknown_commands:
+        return catalogue.parse
+    parse = catalogue.parse
+
+    def parse_reading_suggestions(message: str):
+        try:
+            return parse(message)
+        except CommandNotRecognizedException as e:
+            return e.suggestions
+    return parse_reading_suggestions
+
+
+@timed
+def measure_build(commands_dict: dict, settings: dict, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        CommandCatalogue(commands_dict, **settings)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+@timed
+def measure_throughput(catalogue, messages: list, repeat: int):
+    parse = get_parse(catalogue)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for message in messages:
+            parse(message)
+        best = min(best, time.perf_counter() - start)
+    return len(messages) / best
+
+
+@timed
+def measure_latencies(catalogue, messages: list, repeat: int):
+    """
+    Returns the latency percentiles of parsing each message, each the median over repeat passes.
+    The tail of a single pass depends on what else the machine was doing, so neither
+    its best nor its worst pass is a stable measurement of it.
+    """
+    parse = get_parse(catalogue)
+    clock = time.perf_counter_ns
+    passes = {"p50_us": [], "p90_us": [], "p99_us": []}
+    for _ in range(repeat):
+        latencies = []
+        for message in messages:
+            start = clock()
+            parse(message)
+            latencies.append(clock() - start)
+        latencies.sort()
+        for name, fraction in (("p50_us", 0.50), ("p90_us", 0.90), ("p99_us", 0.99)):
+            passes[name].append(percentile(latencies, fraction) / 1000)
+    return {name: percentile(sorted(values), 0.5) for name, values in passes.items()}
+
+
+def measure_peak_parse(catalogue, messages: list):
+    parse = get_parse(catalogue)
+    peaks = []
+    tracemalloc.start()
+    for message in messages:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        parse(message)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    peaks.sort()
+    return percentile(peaks, 0.5)
+
+
+def run_scenario(name: str, scale: float = 1.0, repeat: int = 3):
+    catalogue_arguments, corpus_arguments = scale_scenario(*SCENARIOS[name][:2], scale)
+    settings = dict(DEFAULT_SETTINGS, **(SCENARIOS[name][2] if len(SCENARIOS[name]) > 2 else {}))
+    commands_dict = make_commands_dict(**catalogue_arguments)
+    messages = make_messages(commands_dict, **corpus_arguments)
+
+    results = {"build_seconds": measure_build(commands_dict, settings, repeat)}
+    # Sub commands are counted too, so catalogues of different shapes can be compared
+    results["bytes_per_command"] = measure_catalogue(commands_dict)[1] * len(commands_dict) / count_commands(commands_dict)
+    catalogue = CommandCatalogue(commands_dict, **settings)
+    results["messages_per_second"] = measure_throughput(catalogue, messages, repeat)
+    results.update(measure_latencies(catalogue, messages, repeat))
+    # A sample of the corpus is enough, since tracing slows every parse down
+    results["peak_bytes_per_parse"] = measure_peak_parse(catalogue, messages[:1000])
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = None):
+    """
+    Returns a list of (scenario, metric, baseline value, value, relative change) for every metric
+    of results that is worse than in the baseline by more than its tolerance in TOLERANCES,
+    or by more than tolerance if it is given.
+    The relative change is positive when the metric got worse.
+    """
+    regressions = []
+    for scenario, metrics in results.items():
+        for metric, value in metrics.items():
+            baseline_value = baseline.get(scenario, {}).get(metric)
+            if not baseline_value:
+                continue
+            change = (value - baseline_value) / baseline_value
+            if metric in HIGHER_IS_BETTER:
+                change = -change
+            if change > (tolerance if tolerance is not None else TOLERANCES.get(metric, DEFAULT_TOLERANCE)):
+                regressions.append((scenario, metric, baseline_value, value, change))
+    return regressions
+
+
+def format_value(value: float):
+    return f"{value:.3g}" if value < 1000 else f"{value:,.0f}"
+
+
+def print_results(results: dict, baseline: dict):
+    for scenario, metrics in results.items():
+        print(scenario)
+        for metric, value in metrics.items():
+            line = f"    {metric:<22}{format_value(value):>14}"
+            baseline_value = baseline.get(scenario, {}).get(metric)
+            if baseline_value:
+                line += f"    baseline {format_value(baseline_value):>12}  ({(value - baseline_value) / baseline_value:+.1%})"
+            print(line)
+
+
+def get_environment():
+    return {"python": platform.python_version(), "implementation": platform.python_implementation(), "machine": platform.machine()}
+
+
+def main(argv: list = None):
+    parser = argparse.ArgumentParser(description = "Benchmarks BOWDN with synthetic catalogues and messages.")
+    parser.add_argument("--scenario", action = "append", choices = sorted(SCENARIOS), help = "Only run this scenario, may be given more than once.")
+    parser.add_argument("--quick", action = "store_true", help = f"Scale every catalogue and corpus down to {QUICK_SCALE:.0%} of its size.")
+    parser.add_argument("--repeat", type = int, default = 3, help = "How many times to time each measurement, the best time or median percentile is kept.")
+    parser.add_argument("--baseline", default = DEFAULT_BASELINE, help = "The baseline file to compare to or save.")
+    parser.add_argument("--save", action = "store_true", help = "Save the results as the baseline instead of comparing to it.")
+    parser.add_argument("--tolerance", type = float, help = "How much worse than the baseline every metric may get before it is a regression, instead of the tolerance of each metric.")
+    arguments = parser.parse_args(argv)
+
+    scale = QUICK_SCALE if arguments.quick else 1.0
+    results = {}
+    for name in arguments.scenario or SCENARIOS:
+        results[name] = run_scenario(name, scale, arguments.repeat)
+
+    baseline_file = {}
+    if os.path.exists(arguments.baseline):
+        with open(arguments.baseline) as file:
+            baseline_file = json.load(file)
+    # A baseline of a different scale cannot be compared to
+    baseline = baseline_file.get("results", {}) if baseline_file.get("scale") == scale else {}
+
+    if arguments.save:
+        print_results(results, {})
+        if baseline_file.get("scale") == scale:
+            results = dict(baseline_file.get("results", {}), **results)
+        with open(arguments.baseline, "w") as file:
+            json.dump({"scale": scale, "environment": get_environment(), "results": results}, file, indent = 4)
+        print(f"Saved the baseline to {arguments.baseline}")
+        return 0
+
+    print_results(results, baseline)
+    if not baseline:
+        print(f"There is no baseline at scale {scale} in {arguments.baseline} to compare to, save one with --save.")
+        return 0
+    if baseline_file.get("environment") != get_environment():
+        print(f"The baseline was saved on {baseline_file.get('environment')}, so its timings may not be comparable.")
+    regressions = compare(results, baseline, arguments.tolerance)
+    for scenario, metric, baseline_value, value, change in regressions:
+        print(f"Regression: {scenario} {metric} went from {format_value(baseline_value)} to {format_value(value)} ({change:.1%} worse)")
+    if not regressions:
+        print("No regressions." if arguments.tolerance is None else f"No regressions of more than {arguments.tolerance:.0%}.")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
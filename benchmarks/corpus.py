@@ -0,0 +1,135 @@
+"""
+Generates synthetic commands dicts and message corpora for the benchmarks.
+Everything is generated from a seed, so the same arguments always give the same catalogue and messages.
+"""
+import random
+
+
+# Flag names that most real catalogues put on every command, which FlagPool shares
+COMMON_FLAGS = ("help", "verbose", "format", "output", "quiet", "force", "limit", "debug")
+
+WORD_CHARACTERS = "abcdefghijklmnopqrstuvwxyz0123456789_"
+
+
+def return_argument_count(*arguments, context = None):
+    return len(arguments)
+
+
+def make_word(randomizer: random.Random, length: int = 8):
+    return "".join(randomizer.choice(WORD_CHARACTERS) for _ in range(length))
+
+
+def make_flags_dict(randomizer: random.Random, flag_count: int):
+    """
+    Returns flag_count flags: the common flags first, then flags unique to the command.
+    Short names are numbered so that they never clash.
+    """
+    flags = {}
+    for i in range(flag_count):
+        name = COMMON_FLAGS[i] if i < len(COMMON_FLAGS) else f"option_{make_word(randomizer, 6)}"
+        accepts_input = i % 3 == 2
+        flags[name] = {
+            "short_name": f"f{i}",
+            "long_aliases": [f"{name}_alias"] if i % 4 == 1 else [],
+            "accepts_input": accepts_input,
+            "default_value_present": "value" if accepts_input else True,
+            "default_value_absent": None if accepts_input else False
+        }
+    return flags
+
+
+def make_commands_dict(
+    command_count: int     = 1000,
+    depth: int             = 0,
+    sub_command_count: int = 3,
+    alias_count: int       = 2,
+    flag_count: int        = 3,
+    seed: int              = 0
+):
+    """
+    Returns a commands dict of command_count top level commands.
+    Each command has alias_count aliases and flag_count flags, and sub_command_count
+    sub commands on each of depth levels below it, which also have the aliases and flags.
+    """
+    randomizer = random.Random(seed)
+
+    def make_level(count: int, level: int, prefix: str):
+        commands = {}
+        for i in range(count):
+            name = f"{prefix}{i}_{make_word(randomizer, 4)}"
+            command = {
+                "aliases": [f"{name}_a{j}" for j in range(alias_count)],
+                "description": f"Generated command {name}.",
+                "function": return_argument_count,
+                "flags": make_flags_dict(randomizer, flag_count)
+            }
+            if level < depth:
+                command["sub_commands"] = make_level(sub_command_count, level + 1, f"{name}_sub")
+            commands[name] = command
+        return commands
+
+    return make_level(command_count, 0, "cmd")
+
+
+def make_argument(randomizer: random.Random, quoted_ratio: float):
+    if randomizer.random() >= quoted_ratio:
+        return make_word(randomizer, randomizer.randint(3, 12))
+    words = " ".join(make_word(randomizer, randomizer.randint(2, 8)) for _ in range(randomizer.randint(2, 5)))
+    kind = randomizer.randrange(3)
+    if kind == 0:
+        return f"'{words}'"
+    if kind == 1:
+        return f'"{words}"'
+    return f'"{words} \\"escaped\\" {words}"'
+
+
+def make_messages(
+    commands_dict: dict,
+    count: int                 = 10000,
+    hit_ratio: float           = 0.9,
+    flag_ratio: float          = 0.5,
+    argument_count: tuple      = (0, 4),
+    long_argument_ratio: float = 0.0,
+    long_argument_count: int   = 200,
+    quoted_ratio: float        = 0.1,
+    seed: int                  = 0
+):
+    """
+    Returns count messages for a commands dict.
+    -   hit_ratio of them start with a command or alias, and the rest with an unknown word.
+    -   A hit descends into a random number of sub commands, then gives each flag of
+        the command it ended on with a chance of flag_ratio.
+    -   Messages have between argument_count[0] and argument_count[1] arguments, or
+        long_argument_count arguments for long_argument_ratio of them.
+    -   quoted_ratio of the arguments are quoted and contain spaces, some with escaped quotes.
+    """
+    randomizer = random.Random(seed)
+    top_level = list(commands_dict.items())
+    messages = []
+    for _ in range(count):
+        tokens = []
+        if randomizer.random() < hit_ratio:
+            name, command = randomizer.choice(top_level)
+            tokens.append(randomizer.choice([name] + list(command.get("aliases", ()))))
+            while command.get("sub_commands") and randomizer.random() < 0.7:
+                name, command = randomizer.choice(list(command["sub_commands"].items()))
+                tokens.append(name)
+            for flag_name, flag in command.get("flags", {}).items():
+                if randomizer.random() >= flag_ratio:
+                    continue
+                if flag["accepts_input"]:
+                    tokens.append(f"--{flag_name}={make_word(randomizer, 5)}")
+                elif randomizer.random() < 0.5:
+                    tokens.append(f"-{flag['short_name']}")
+                else:
+                    tokens.append(f"--{flag_name}")
+        else:
+            tokens.append(f"unknown_{make_word(randomizer, 6)}")
+
+        if randomizer.random() < long_argument_ratio:
+            arguments = long_argument_count
+        else:
+            arguments = randomizer.randint(*argument_count)
+        tokens.extend(make_argument(randomizer, quoted_ratio) for _ in range(arguments))
+        messages.append(" ".join(tokens))
+    return messages
@@ -1,4 +1,14 @@
+import asyncio
+import json
+import pickle
+import socket
+import time
+import threading
+import pytest
+from concurrent.futures import ProcessPoolExecutor
 from BOWDN import CommandCatalogue
+from BOWDN.exceptions import CommandArgumentsException, DuplicateAliasException, CommandNotRecognizedException, SnapshotException, SnapshotOutdatedException, CommandRejectedException
+from BOWDN.profiling import ActiveRun
 from testing_command_dict import *
 
 
@@ -14,6 +24,31 @@ def test_create_catalogue():
 # test_create_catalogue()
 
 
+def test_alias_lookup():
+    commands_1 = CommandCatalogue(command_dict_1)
+    command = commands_1.get_command("alias_2")
+    assert command is commands_1.commands["command_1"]
+    assert command.get_sub_command("sub_command_2_alias_2").name == "sub_command_1"
+    assert command.get_flag("--info").flag.long_name == "help"
+    assert command.get_flag("-i").flag.long_name == "help"
+    assert command.get_flag("-info") is None
+    assert command.get_flag("--additional_message=hi").value == "hi"
+    assert command.get_flag("-am=hi").value == "hi"
+    assert commands_1.get_command("not_a_command") is None
+
+
+def test_duplicate_alias():
+    with pytest.raises(DuplicateAliasException):
+        CommandCatalogue({
+            "command_1": {"aliases": ["c"]},
+            "command_2": {"aliases": ["c"]}
+        })
+    with pytest.raises(DuplicateAliasException):
+        CommandCatalogue({
+            "command_1": {"flags": {"verbose": {"short_name": "v"}, "version": {"short_name": "v"}}}
+        })
+
+
 
 
 
@@ -27,4 +62,647 @@ message = 'command_1 -h --example_flag_2 -am="This flag gives it an extra messag
 print(commands_1.parse(message, kwarg_demo="This is an extra kwarg you can pass through. This can be anything of any type."))
 
 
-# (commands.parse('test'))
\ No newline at end of file
+# (commands.parse('test'))
+
+def test_non_command_messages():
+    commands_1 = CommandCatalogue(command_dict_1, prefix = "!", ignore_unknown_commands = True)
+    assert commands_1.parse("hello there " * 10000, default = "not a command") == "not a command"
+    assert commands_1.parse("!hello there", default = "not a command") == "not a command"
+    assert commands_1.parse("", default = "not a command") == "not a command"
+    assert commands_1.parse("command_1 argument_1 argument_2", default = "not a command") == "not a command"
+    token_types, token_objects = commands_1.classify_tokens("  !alias_1 -h argument_1")
+    assert token_types == ("Command", "Flag", "Argument")
+
+    commands_2 = CommandCatalogue(command_dict_1)
+    with pytest.raises(CommandNotRecognizedException):
+        commands_2.parse("hello there")
+
+
+def test_parse_cache():
+    commands_1 = CommandCatalogue(command_dict_1, cache_size = 2)
+    message = 'command_1 -h -am="extra" argument_1 argument_2'
+    first  = commands_1.parse(message, kwarg_demo = "demo")
+    second = commands_1.parse(message, kwarg_demo = "demo")
+    assert first == second
+    assert commands_1.cache_info().hits == 1
+    assert commands_1.cache_info().misses == 1
+
+    commands_1.parse("command_1 -h a b", kwarg_demo = "demo")
+    commands_1.parse("command_1 -h c d", kwarg_demo = "demo")
+    assert commands_1.cache_info().currsize == 2
+    assert commands_1.get_parse_plan(message) is not commands_1.get_parse_plan("command_1 -h a b")
+
+    commands_1.invalidate_cache()
+    assert commands_1.cache_info().currsize == 0
+
+
+def test_parse_async():
+    running = []
+    most_running = []
+
+    async def slow_command(argument, context = None):
+        running.append(argument)
+        most_running.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(argument)
+        return argument
+
+    def sync_command(argument, context = None):
+        return argument.upper()
+
+    commands = CommandCatalogue({
+        "slow": {"function": slow_command},
+        "sync": {"function": sync_command}
+    }, max_concurrency = 2)
+
+    async def main():
+        results = await asyncio.gather(*(commands.parse_async(f"slow {i}") for i in range(6)))
+        assert results == [str(i) for i in range(6)]
+        assert await commands.parse_async("sync hello") == "HELLO"
+        assert await commands.parse_async("", default = "empty") == "empty"
+
+    asyncio.run(main())
+    assert max(most_running) == 2
+
+    # The concurrency limit still works in a new event loop
+    most_running.clear()
+    asyncio.run(main())
+    assert max(most_running) == 2
+
+
+def echo_command(*arguments, context = None):
+    return " ".join(arguments)
+
+def lock_command(context = None):
+    return threading.Lock()
+
+batch_command_dict = {"echo": {"function": echo_command}}
+
+
+def test_parse_many():
+    commands = CommandCatalogue(batch_command_dict)
+    messages = (message for message in ["echo a b", "not_a_command", "echo c\n", "", "echo 'd e'"])
+    results = list(commands.parse_many(messages, default = "empty"))
+    assert [result.index for result in results] == [0, 1, 2, 3, 4]
+    assert [result.value for result in results if result.ok] == ["a b", "c", "empty", "d e"]
+    assert isinstance(results[1].exception, CommandNotRecognizedException)
+
+    messages = [f"echo {i}" for i in range(50)]
+    results = list(commands.parse_many(messages, executor = "process", max_workers = 2, ordered = False))
+    assert sorted(int(result.value) for result in results) == list(range(50))
+
+    # A result that cannot be sent back from a worker only fails its own message
+    commands.register_command("lock", {"function": lock_command})
+    results = list(commands.parse_many(["echo a", "lock", "echo b"], executor = "process", max_workers = 2))
+    assert [result.value for result in results if result.ok] == ["a", "b"]
+    assert results[1].index == 1 and isinstance(results[1].exception, Exception)
+
+    with ProcessPoolExecutor(1) as pool, pytest.raises(ValueError):
+        list(commands.parse_many(messages, executor = pool))
+
+
+def test_parse_many_from_snapshot(tmp_path):
+    path = str(tmp_path / "batch.snapshot")
+    CommandCatalogue(batch_command_dict).save_snapshot(path)
+    # Without its commands dict, the workers load the snapshot too
+    commands = CommandCatalogue.load_snapshot(path)
+    messages = [f"echo {i}" for i in range(20)]
+    results = list(commands.parse_many(messages, executor = "process", max_workers = 2))
+    assert [result.value for result in results] == [str(i) for i in range(20)]
+
+    commands.register_command("echo_2", {"function": echo_command})
+    with pytest.raises(ValueError):
+        list(commands.parse_many(messages, executor = "process", max_workers = 2))
+
+
+def test_classify_tokens():
+    commands_1 = CommandCatalogue(command_dict_1)
+    token_types, token_objects = commands_1.classify_tokens("alias_1 -h sub_command_1 -i arg -h")
+    assert token_types == ("Command", "Flag", "Argument", "Argument", "Argument", "Argument")
+    token_types, token_objects = commands_1.classify_tokens("alias_1 sub_command_1 -i arg -h")
+    assert token_types == ("Command", "Sub Command", "Flag", "Argument", "Argument")
+    assert token_objects[1].name == "sub_command_1"
+
+    arguments = [str(i) for i in range(2000)]
+    plan = commands_1.get_parse_plan("command_1 --info " + " ".join(arguments))
+    assert plan.arguments == tuple(arguments)
+    assert plan.flags["help"].value is True
+    assert plan.flags["extra_message"] == command_dict_1["command_1"]["flags"]["extra_message"]["default_value_absent"]
+
+
+def test_snapshot(tmp_path):
+    path = str(tmp_path / "catalogue.snapshot")
+    commands_1 = CommandCatalogue(command_dict_1, prefix = "!")
+    commands_1.save_snapshot(path)
+
+    loaded = CommandCatalogue.load_snapshot(path, command_dict_1)
+    message = '!alias_1 -h -am="extra" argument_1 argument_2'
+    assert loaded.prefix == "!"
+    assert loaded.parse(message, kwarg_demo = "demo") == commands_1.parse(message, kwarg_demo = "demo")
+    assert loaded.get_command("alias_2").get_sub_command("sub_command_1").function is command_function_to_run_2
+
+    changed_dict = dict(command_dict_1, command_2 = {"aliases": ["c2"]})
+    with pytest.raises(SnapshotOutdatedException):
+        CommandCatalogue.load_snapshot(path, changed_dict)
+
+    with pytest.raises(SnapshotException):
+        CommandCatalogue({"command": {"function": lambda context = None: None}}).save_snapshot(path)
+
+
+def test_lazy_sub_commands():
+    commands_1 = CommandCatalogue(command_dict_1, lazy = True)
+    command = commands_1.get_command("command_1")
+    assert command.sub_command_loader is not None
+    assert len(command.sub_commands) == 0
+
+    results = []
+    threads = [threading.Thread(target = lambda: results.append(command.get_sub_command("sub_command_1"))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert command.sub_command_loader is None
+    assert all(result is results[0] for result in results)
+    assert commands_1.classify_tokens("command_1 sub_command_1_alias_1 -h")[0] == ("Command", "Sub Command", "Flag")
+
+
+def test_register_commands():
+    commands = CommandCatalogue(batch_command_dict, cache_size = 16)
+    assert commands.parse("echo a") == "a"
+
+    commands.register_command("queue", {"aliases": ["q"], "function": lambda context = None: "queue"})
+    commands.register_command("queue list", {"function": lambda *items, context = None: list(items)})
+    old_queue = commands.get_command("q")
+    assert commands.parse("q") == "queue"
+    assert commands.parse("queue list a b") == ["a", "b"]
+    assert "list" in commands.commands_dict["queue"]["sub_commands"]
+
+    with pytest.raises(DuplicateAliasException):
+        commands.register_command("queue list", {})
+    with pytest.raises(DuplicateAliasException):
+        commands.register_command("other", {"aliases": ["q"]})
+
+    commands.replace_command(["queue", "list"], {"function": lambda *items, context = None: len(items)})
+    assert commands.parse("queue list a b") == 2
+    assert old_queue.get_sub_command("list").function("a", "b") == ["a", "b"]
+
+    commands.unregister_command("queue list")
+    assert commands.classify_tokens("queue list")[0] == ("Command", "Argument")
+    commands.unregister_command("queue")
+    with pytest.raises(CommandNotRecognizedException):
+        commands.parse("queue")
+    with pytest.raises(CommandNotRecognizedException):
+        commands.unregister_command("queue")
+
+
+def test_register_commands_while_parsing():
+    commands = CommandCatalogue(batch_command_dict, cache_size = 16)
+    errors = []
+    stop = threading.Event()
+
+    def parse_forever():
+        while not stop.is_set():
+            try:
+                assert commands.parse("echo a b") == "a b"
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target = parse_forever) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for i in range(200):
+        commands.register_command(f"command_{i}", {"aliases": [f"alias_{i}"]})
+        commands.replace_command("echo", {"function": echo_command})
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(commands.commands) == 201
+
+
+def test_suggestions():
+    commands_1 = CommandCatalogue(command_dict_1)
+    with pytest.raises(CommandNotRecognizedException) as exception_info:
+        commands_1.parse("comand_1 -h")
+    assert exception_info.value.token == "comand_1"
+    assert exception_info.value.suggestions == ["command_1"]
+    with pytest.raises(CommandNotRecognizedException) as exception_info:
+        commands_1.parse("alias_ -h")
+    assert exception_info.value.suggestions == ["alias_1", "alias_2", "alias_3"]
+
+    # Suggestions are only looked up when they are read, and survive pickling
+    with pytest.raises(CommandNotRecognizedException) as exception_info:
+        commands_1.parse("comand_1 -h")
+    assert exception_info.value.materialized_suggestions is None
+    assert pickle.loads(pickle.dumps(exception_info.value)).suggestions == ["command_1"]
+
+    assert commands_1.get_command_completions("al") == ["alias_1", "alias_2", "alias_3"]
+    command = commands_1.get_command("command_1")
+    assert command.get_sub_command_completions("sub_command_2") == ["sub_command_2_alias_2"]
+    assert command.get_sub_command_suggestions("sub_comand_1") == ["sub_command_1"]
+
+    commands_1.register_command("comand_2", {})
+    assert commands_1.get_command_suggestions("comand_1")[:2] == ["comand_2", "command_1"]
+
+
+def test_instrumentation():
+    def fail(context = None):
+        raise ValueError("failed")
+
+    commands = CommandCatalogue(dict(batch_command_dict, fail = {"function": fail}))
+    instrumentation = commands.enable_instrumentation()
+    commands.parse("echo a")
+    commands.parse("echo b")
+    with pytest.raises(ValueError):
+        commands.parse("fail")
+    with pytest.raises(CommandNotRecognizedException):
+        commands.parse("not_a_command")
+    asyncio.run(commands.parse_async("echo c"))
+
+    snapshot = instrumentation.snapshot()
+    assert snapshot["echo"]["calls"] == 3
+    assert snapshot["echo"]["errors"] == 0
+    assert snapshot["echo"]["run_latency"]["count"] == 3
+    assert snapshot["echo"]["run_latency"]["buckets"][-1] == (float("inf"), 3)
+    assert snapshot["fail"]["errors"] == 1
+    assert snapshot["<unrecognized>"]["run_latency"]["count"] == 0
+
+    text = instrumentation.to_prometheus()
+    assert 'bowdn_command_calls_total{command="echo"} 3' in text
+    assert 'bowdn_command_run_seconds_bucket{command="echo",le="+Inf"} 3' in text
+
+    commands.disable_instrumentation()
+    commands.parse("echo d")
+    assert instrumentation.snapshot()["echo"]["calls"] == 3
+
+
+def slow_command(seconds, context = None):
+    time.sleep(float(seconds))
+    return seconds
+
+
+def test_profiling(tmp_path):
+    commands = CommandCatalogue({"slow": {"function": slow_command}})
+    profiler = commands.enable_profiling(0.02, sample_interval = 0.002, min_capture_interval = 60, directory = str(tmp_path))
+    commands.parse("slow 0")
+    assert len(profiler.captures) == 0
+
+    commands.parse("slow 0.1")
+    assert len(profiler.captures) == 1
+    capture = profiler.captures[0]
+    assert capture.command_path == "slow"
+    assert capture.message == "slow 0.1"
+    assert capture.duration >= 0.1
+    assert any("slow_command" in frame for frame in capture.top_stacks(1)[0][0])
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # Rate limited
+    commands.parse("slow 0.05")
+    assert len(profiler.captures) == 1
+    assert profiler.skipped_captures == 1
+
+    sampler = profiler.sampler
+    commands.disable_profiling()
+    assert not sampler.is_alive()
+
+    # A capture that cannot be written does not change what the command returns
+    blocked = tmp_path / "blocked"
+    blocked.write_text("")
+    profiler = commands.enable_profiling(0.02, sample_interval = 0.002, directory = str(blocked / "captures"))
+    assert commands.parse("slow 0.05") == "0.05"
+    assert len(profiler.captures) == 1
+    assert profiler.failed_writes == 1
+
+    # A run that already returned is not captured, and does not count against the rate limit
+    # Cacheable commands are profiled when they miss the cache
+    cached = CommandCatalogue({"slow": {"function": slow_command, "cache": True}})
+    profiler = cached.enable_profiling(0.02, sample_interval = 0.002)
+    cached.parse("slow 0.05")
+    cached.parse("slow 0.05")
+    assert len(profiler.captures) == 1
+    cached.disable_profiling()
+
+    run = ActiveRun(threading.get_ident(), 0.0, commands.get_parse_plan("slow 1"), None)
+    run.finished = True
+    profiler = commands.enable_profiling(0.02)
+    assert not profiler.start_capture(run, 1.0)
+    assert profiler.last_capture_start is None
+    commands.disable_profiling()
+
+
+def test_result_cache():
+    calls = []
+
+    def lookup(*arguments, context = None):
+        calls.append(arguments)
+        return f"{arguments} {context.flags.get('verbose')}"
+
+    commands = CommandCatalogue({
+        "info": {
+            "function": lookup,
+            "cache": {"ttl": 60, "max_size": 2},
+            "flags": {"verbose": {"short_name": "v", "default_value_present": True, "default_value_absent": False}},
+            "sub_commands": {"fresh": {"function": lookup}}
+        }
+    })
+    first = commands.parse("info a")
+    assert commands.parse("info a") == first
+    assert len(calls) == 1
+    commands.parse("info -v a")
+    commands.parse("info b")
+    assert len(calls) == 3
+    commands.parse("info fresh a")
+    commands.parse("info fresh a")
+    assert len(calls) == 5
+
+    info = commands.get_result_cache_info("info")
+    assert info.hits == 1
+    assert info.evictions == 1
+    assert commands.get_result_cache_info("info fresh") is None
+
+    commands.invalidate_results()
+    commands.parse("info b")
+    assert len(calls) == 6
+    assert asyncio.run(commands.parse_async("info b")) == commands.parse("info b")
+    assert len(calls) == 6
+
+
+def test_scheduler():
+    ran = []
+    gate = threading.Event()
+
+    def record(name, context = None):
+        ran.append(name)
+        return name
+
+    def wait_for_gate(context = None):
+        gate.wait(5)
+        return "expensive"
+
+    commands = CommandCatalogue({
+        "cheap":     {"function": record},
+        "urgent":    {"function": record, "meta_data": {"priority": 10}},
+        "limited":   {"function": record, "meta_data": {"rate_limit": {"rate": 1, "burst": 1}}},
+        "expensive": {"function": wait_for_gate, "meta_data": {"cost": 10}},
+        "huge":      {"function": record, "meta_data": {"cost": 20}},
+        "bulk":      {"function": record, "meta_data": {"cost": 3, "rate_limit": {"rate": 100, "burst": 2}}}
+    })
+
+    with commands.create_scheduler(caller_rate = 100, caller_burst = 10, cheap_workers = 1) as scheduler:
+        # An expensive command that is still running does not delay cheap ones
+        expensive = scheduler.submit("expensive", caller = "a")
+        assert scheduler.submit("cheap 1", caller = "b").result(5) == "1"
+        assert not expensive.done()
+
+        # Per caller limit: the burst is 10 and "expensive" cost caller a all 10 tokens
+        rejected = scheduler.submit("cheap 2", caller = "a")
+        assert rejected.status == "Rejected"
+        with pytest.raises(CommandRejectedException) as exception_info:
+            rejected.result()
+        assert exception_info.value.reason == "rate_limited"
+        assert exception_info.value.retry_after > 0
+
+        # Per command limit, shared by every caller
+        assert scheduler.submit("limited 1", caller = "c").result(5) == "1"
+        assert scheduler.submit("limited 2", caller = "d").status == "Rejected"
+
+        # Deferred until the caller has tokens again
+        for i in range(10):
+            scheduler.submit(f"cheap {i}", caller = "e")
+        deferred = scheduler.submit("cheap deferred", caller = "e", on_limit = "defer")
+        assert deferred.status == "Deferred"
+        assert deferred.result(5) == "deferred"
+
+        # A cost above a bucket's burst can never be paid, so waiting would not help
+        for message in ("huge", "bulk"):
+            for on_limit in ("reject", "defer"):
+                too_costly = scheduler.submit(message, caller = "f", on_limit = on_limit)
+                assert too_costly.status == "Rejected"
+                with pytest.raises(CommandRejectedException) as exception_info:
+                    too_costly.result()
+                assert exception_info.value.reason == "cost_exceeds_burst"
+                assert exception_info.value.retry_after is None and too_costly.retry_after is None
+
+        gate.set()
+        assert expensive.result(5) == "expensive"
+
+    # Higher priority runs first once the worker is free
+    ran.clear()
+    block = threading.Event()
+    commands.register_command("block", {"function": lambda context = None: block.wait(5)})
+    with commands.create_scheduler(caller_rate = 100, caller_burst = 100, cheap_workers = 1) as scheduler:
+        scheduler.submit("block")
+        time.sleep(0.05)
+        low  = scheduler.submit("cheap low")
+        high = scheduler.submit("urgent high")
+        block.set()
+        low.result(5)
+        high.result(5)
+    assert ran == ["high", "low"]
+
+
+def test_scheduler_max_callers():
+    commands = CommandCatalogue(batch_command_dict)
+    with commands.create_scheduler(caller_rate = 0.001, caller_burst = 1, max_callers = 3) as scheduler:
+        for caller in ("a", "b", "c"):
+            scheduler.submit("echo x", caller = caller).result(5)
+        # a is seen again, so b is now the least recent caller and is dropped for d
+        assert scheduler.submit("echo x", caller = "a").status == "Rejected"
+        scheduler.submit("echo x", caller = "d").result(5)
+        assert list(scheduler.caller_buckets) == ["c", "a", "d"]
+        for caller in range(100):
+            scheduler.submit("echo x", caller = caller)
+        assert len(scheduler.caller_buckets) == 3
+
+
+def test_lazy_context():
+    contexts = []
+
+    def paste(*arguments, context = None):
+        contexts.append(context)
+        return arguments
+
+    commands = CommandCatalogue({
+        "paste": {
+            "function": paste,
+            "flags": {"raw": {"short_name": "r", "default_value_present": True, "default_value_absent": False}},
+            "sub_commands": {"code": {"function": paste}}
+        }
+    }, prefix = "!", cache_size = 8)
+    payload = "x" * 10000
+    assert commands.parse(f"  !paste code {payload} 'a b'  ") == (payload, "a b")
+
+    context = contexts[-1]
+    assert context.materialized_tokens is None and context.materialized_flags is None
+    assert context.token_types == ("Command", "Sub Command", "Argument", "Argument")
+    assert context.tokens[2:] == (payload, "a b")
+    assert context.flags == {}
+    assert commands.classify_tokens("!paste -r one two")[0] == ("Command", "Flag", "Argument", "Argument")
+
+    # Changing the flags of one context does not change the cached plan they came from
+    commands.parse("!paste -r one")
+    contexts[-1].flags["raw"] = None
+    commands.parse("!paste -r one")
+    assert contexts[-1].flags["raw"].value is True
+
+
+def test_argument_binding():
+    calls = []
+
+    def add(a, b = 0, *, context = None):
+        calls.append((a, b))
+        return int(a) + int(b)
+
+    async def add_async(a, *, context):
+        return int(a)
+
+    commands = CommandCatalogue({
+        "add": {
+            "function": add,
+            "flags": {"verbose": {"short_name": "v", "default_value_absent": False}},
+            "sub_commands": {"async": {"function": add_async}}
+        }
+    })
+    assert commands.parse("add 1 2") == 3
+    assert commands.parse("add 1") == 1
+    with pytest.raises(CommandArgumentsException) as exception:
+        commands.parse("add 1 2 3")
+    assert exception.value.command_name == "add"
+    with pytest.raises(CommandArgumentsException):
+        commands.parse("add")
+    with pytest.raises(CommandArgumentsException):
+        commands.parse("add 1", extra = True)
+    with pytest.raises(TypeError):
+        commands.parse("add -v")
+    assert calls == [("1", "2"), ("1", 0)]
+
+    assert asyncio.run(commands.parse_async("add async 5")) == 5
+    with pytest.raises(CommandArgumentsException):
+        asyncio.run(commands.parse_async("add async 5 6"))
+
+    plan = commands.get_parse_plan("add -v 1")
+    assert plan.flags["verbose"].value is None
+    assert dict(commands.get_command("add").flag_defaults) == {"verbose": False}
+
+
+def test_shared_flags():
+    help_flag = {"short_name": "h", "default_value_present": True, "default_value_absent": False}
+    commands = CommandCatalogue({
+        "queue": {
+            "function": echo_command,
+            "flags": {"help": dict(help_flag)},
+            "inherited_flags": {"format": {"short_name": "f", "accepts_input": True, "default_value_absent": "text"}},
+            "sub_commands": {
+                "list": {"function": echo_command, "flags": {"help": dict(help_flag)}},
+                "clear": {"function": echo_command, "flags": {"format": {"short_name": "f", "default_value_absent": 1}}}
+            }
+        },
+        "status": {"function": echo_command, "flags": {"help": dict(help_flag)}},
+        "ping": {"function": echo_command, "flags": {"help": dict(help_flag)}}
+    }, global_flags = {"verbose": {"short_name": "v", "default_value_present": True, "default_value_absent": False}})
+
+    queue, status = commands.get_command("queue"), commands.get_command("status")
+    queue_list = queue.get_sub_command("list")
+    assert queue.flags[0] is status.flags[0] is queue_list.flags[0]
+    ping = commands.get_command("ping")
+    assert status.flags is ping.flags and status.short_flag_index is ping.short_flag_index
+    assert [flag.long_name for flag in queue.flags] == ["help", "format", "verbose"]
+    assert [flag.long_name for flag in queue_list.flags] == ["help", "format", "verbose"]
+    assert queue.get_sub_command("clear").flag_defaults["format"] == 1
+    assert commands.get_parse_plan("queue list -f=json -v").flags["format"].value == "json"
+    assert commands.get_parse_plan("status").flags == {"help": False, "verbose": False}
+
+    # True == 1, but a flag defaulting to True is not the same flag as one defaulting to 1
+    commands.register_command("queue show", {"function": echo_command, "flags": {"help": dict(help_flag, default_value_absent = 1)}})
+    show = commands.get_command("queue").get_sub_command("show")
+    assert show.flag_defaults["help"] == 1 and type(show.flag_defaults["help"]) is int
+    assert [flag.long_name for flag in show.flags] == ["help", "format", "verbose"]
+
+
+def test_server(tmp_path):
+    from BOWDN.server import encode_frame, read_frame
+
+    running = []
+    most_running = []
+
+    async def wait_command(seconds, context = None):
+        running.append(seconds)
+        most_running.append(len(running))
+        await asyncio.sleep(float(seconds))
+        running.remove(seconds)
+        return seconds
+
+    commands = CommandCatalogue({"echo": {"function": echo_command}, "wait": {"function": wait_command}})
+
+    async def request(reader, writer, framing, *messages):
+        writer.write(b"".join(encode_frame(message.encode(), framing) for message in messages))
+        await writer.drain()
+        return [json.loads(await read_frame(reader, framing)) for _ in messages]
+
+    async def main():
+        async with commands.create_server(max_connections = 2, max_pending = 2, max_message_size = 100) as server:
+            await server.start_tcp()
+            reader, writer = await asyncio.open_connection(*server.get_address())
+            # Pipelined requests are answered in order, even when the first one finishes last
+            responses = await request(reader, writer, "line", "wait 0.05", "echo a b", "ech", "", "echo c")
+            assert responses[0] == {"ok": True, "result": "0.05"}
+            assert responses[1] == {"ok": True, "result": "a b"}
+            assert responses[2]["error"] == "CommandNotRecognizedException" and "echo" in responses[2]["suggestions"]
+            assert responses[3] == {"ok": True, "result": None}
+            assert responses[4]["result"] == "c"
+
+            # At most max_pending requests of a connection are unanswered at once
+            most_running.clear()
+            await request(reader, writer, "line", *["wait 0.01"] * 8)
+            assert max(most_running) == 2
+
+            other = await asyncio.open_connection(*server.get_address())
+            rejected_reader, _ = await asyncio.open_connection(*server.get_address())
+            assert json.loads(await read_frame(rejected_reader))["error"] == "TooManyConnections"
+            assert await read_frame(rejected_reader) is None
+            assert server.rejected_connections == 1
+            other[1].close()
+
+            assert (await request(reader, writer, "line", "echo " + "x" * 200))[0]["error"] == "FrameTooLarge"
+            assert await read_frame(reader) is None
+
+        async with commands.create_server(framing = "length") as server:
+            await server.start_tcp()
+            reader, writer = await asyncio.open_connection(*server.get_address())
+            assert await request(reader, writer, "length", "echo 'multi\nline'") == [{"ok": True, "result": "multi\nline"}]
+            writer.close()
+
+        if hasattr(socket, "AF_UNIX"):
+            async with commands.create_server() as server:
+                await server.start_unix(str(tmp_path / "bowdn.sock"))
+                reader, writer = await asyncio.open_unix_connection(str(tmp_path / "bowdn.sock"))
+                assert await request(reader, writer, "line", "echo unix") == [{"ok": True, "result": "unix"}]
+                writer.close()
+
+    asyncio.run(main())
+
+
+def test_scheduler_runs_submitted_plan():
+    gate = threading.Event()
+    commands = CommandCatalogue({
+        "block":  {"function": lambda context = None: gate.wait(5)},
+        "echo":   {"function": echo_command},
+        "broken": {"function": echo_command, "meta_data": {"rate_limit": {"burst": 1}}}
+    })
+    resolved = []
+    resolve_tokens = commands.resolve_tokens
+    commands.resolve_tokens = lambda message: resolved.append(message) or resolve_tokens(message)
+
+    with commands.create_scheduler(caller_rate = 100, caller_burst = 100, cheap_workers = 1) as scheduler:
+        scheduler.submit("block")
+        queued = scheduler.submit("echo a")
+        # The command that was charged for runs, even if it is replaced before its turn
+        commands.replace_command("echo", {"function": lambda *arguments, context = None: "replaced"})
+        gate.set()
+        assert queued.result(5) == "a"
+        assert resolved.count("echo a") == 1
+
+        broken = scheduler.submit("broken")
+        assert broken.status == "Failed"
+        with pytest.raises(ValueError):
+            broken.result()
@@ -0,0 +1,75 @@
+import random
+import shlex
+from BOWDN import CommandCatalogue
+from BOWDN.tokenizer import fast_tokenize
+from testing_command_dict import *
+
+
+def shlex_result(string):
+    try:
+        return shlex.split(string)
+    except ValueError as e:
+        return str(e)
+
+
+def fast_result(string):
+    try:
+        return fast_tokenize(string)
+    except ValueError as e:
+        return str(e)
+
+
+def test_fast_tokenize_examples():
+    messages = [
+        'command_1 -h --example_flag_2 -am="This flag gives it an extra message." This_is_argument_1 "This is argument 2"',
+        "",
+        "   ",
+        "a 'b c' d",
+        'a"b c"d',
+        "''",
+        'a "" b',
+        'a "\\"quoted\\"" b',
+        'a "back\\slash" b',
+        "a \\ b",
+        "a\\",
+        "a 'b",
+        'a "b',
+        "\t a \n b \r",
+    ]
+    for message in messages:
+        assert fast_result(message) == shlex_result(message), message
+
+
+def test_fast_tokenize_differential():
+    alphabet = ["a", "b", "-", "=", " ", "  ", "\t", "\n", "'", '"', "\\", "é", "\x0b"]
+    randomizer = random.Random(0)
+    for _ in range(20000):
+        message = "".join(randomizer.choice(alphabet) for _ in range(randomizer.randint(0, 12)))
+        assert fast_result(message) == shlex_result(message), repr(message)
+
+
+def test_tokenizer_selection():
+    message = 'command_1 -am="an extra message" argument_1 "argument 2"'
+    fast_catalogue  = CommandCatalogue(command_dict_1)
+    shlex_catalogue = CommandCatalogue(command_dict_1, tokenizer = "shlex")
+    assert fast_catalogue.tokenize_string(message) == shlex_catalogue.tokenize_string(message)
+    assert fast_catalogue.tokenize_string(message)[1] == "-am=an extra message"
+
+
+def test_tokenize_string_span():
+    fast_catalogue  = CommandCatalogue(command_dict_1)
+    shlex_catalogue = CommandCatalogue(command_dict_1, tokenizer = "shlex")
+    alphabet = ["a", "b", " ", "\t", "\n", "\x0b", "\x1c", "　", "'", '"', "\\"]
+    randomizer = random.Random(1)
+    for _ in range(5000):
+        message = "".join(randomizer.choice(alphabet) for _ in range(randomizer.randint(0, 12)))
+        start = randomizer.randint(0, len(message))
+        try:
+            expected = shlex_catalogue.tokenize_string(message, start)
+        except ValueError as e:
+            expected = str(e)
+        try:
+            result = fast_catalogue.tokenize_string(message, start)
+        except ValueError as e:
+            result = str(e)
+        assert result == expected, (repr(message), start)